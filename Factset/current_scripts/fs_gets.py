@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 import modules.xml_mods as xml_tools
 import modules.title_tools as t_tools
+import modules.ref_data as ref_data
 import re
 import ast
 import os
@@ -25,11 +26,21 @@ fs_xmls = fs_master[fs_master.is_duplicate.isna()]
 
 #update to most recent ciq dataset
 # NOTE: this process used to run on ref_master, which is no longer used
-ciq_master = pd.read_csv('../ciq/data_ref/ciq_master.csv', dtype=str)
+# firm names of the master are supercleaned once and cached with it, see title_tools.add_clean_name_cols
+ref_data.set_path('ciq_master', '../ciq/data_ref/ciq_master.csv')
+ciq_master = ref_data.get('ciq_master_clean')
 ciq_master['Year'] = pd.DatetimeIndex(ciq_master.event_date).year
 ciq_master['Month'] = pd.DatetimeIndex(ciq_master.event_date).month
 ciq_master['Day'] = pd.DatetimeIndex(ciq_master.event_date).day
 
+# set to True to only fuzzy score the ciq firm names sharing the most trigrams with each firm name
+# (helps when the date filter leaves thousands of firms)
+use_name_index = False
+name_index = ref_data.get('ciq_name_index') if use_name_index else None
+
+# fuzzy scores of name pairs seen in earlier runs are reused, see title_tools.load_score_cache
+t_tools.load_score_cache()
+
 # initialize dataframe of new factset transcripts
 fs_new = pd.DataFrame()
 
@@ -113,17 +124,17 @@ for i, rest in fs_xmls.iterrows():
                 break
 
             #start fuzzy matching
-            #find unique set of possible names
-            firm_opts = set(subspace.firm_name)
+            #possible names with their precomputed cleaned columns
+            firm_opts = subspace
             # compare_names runs fuzzy matching on firm_names and returns best firm name match
             # if it finds one with sufficient similarity
-            name_check = t_tools.compare_names(firm_name, firm_opts)
+            name_check = t_tools.compare_names(firm_name, firm_opts, index=name_index)
             #if match is found with standard method:
             if name_check[0]:
                 matched = True
                 break
             #try with title name
-            name_check = t_tools.compare_names(title_name, firm_opts)
+            name_check = t_tools.compare_names(title_name, firm_opts, index=name_index)
             if name_check[0]:
                 matched = True
                 break
@@ -148,4 +159,6 @@ while os.path.exists(output_path+'.csv'):
     output_path += '_1'
     print('outpath exists. Adding "_1" to path name')
 fs_new.to_csv(f'{output_path}.csv', index=False)
+t_tools.save_score_cache()
+print(f'Name score cache: {t_tools.score_cache_stats()}')
 print(f'Done! Found {fs_new.shape[0]} new transcripts.\nProcess took {time.time() - start_time} seconds')
\ No newline at end of file
@@ -38,10 +38,11 @@ for fil in file_list:
     # skip if file already in our dataset
     if fil in old_list:
         continue
-    # get xml metas
-    metas = xml_tools.get_xml_metas(None,f'{year}/'+fil)
-    if not metas:
+    # get xml metas and transcript -- the xml is parsed once for both
+    record = xml_tools.get_xml_record(None,f'{year}/'+fil)
+    if record['action'] == 'delete':
         continue
+    metas = [record['cusip'], record['firm_name'], record['event_title'], record['event_date']]
     # get firm_name in call
     firm_name = metas[1]
     # get title of call
@@ -54,7 +55,7 @@ for fil in file_list:
     #add other metadata to file row
     metas.insert(0, fil)
     metas.insert(0, year)
-    text = t_tools.clean_ref_body(xml_tools.get_xml_body(None,f'{year}/'+fil, 'ref'))
+    text = t_tools.clean_ref_body(record['body'])
     metas.append(text)
     all_files.append(metas)
     files += 1
@@ -0,0 +1,114 @@
+import os
+import pickle
+import pandas as pd
+
+direc = '/project/kh_mercury_1/conference_call/xml_pulls/'
+
+# source file of every reference dataset -- change with set_path before first use.
+# Relative paths are resolved against the working folder at import, so a later os.chdir does not move them.
+paths = {
+    'known_name_probs': direc+'codebase/known_name_probs.csv',
+    'ref_historical': direc+'data_ref/Refinitiv_historical_web.csv',
+}
+paths = {source: os.path.abspath(path) for source, path in paths.items()}
+
+# folder for binary caches of loaded data -- None keeps them next to their source files
+cache_dir = None
+
+# reference data loaded so far in this process
+loaded = {}
+
+def load_ref_historical(path):
+    '''
+    Loads master dataset of historical refinitiv transcripts.
+    '''
+    return pd.read_csv(path, low_memory=False, index_col=0)
+
+def load_name_dict(path):
+    '''
+    Loads dictionary of known firm name discrepancies.
+    '''
+    return pd.read_csv(path, index_col=0).squeeze('columns').to_dict()
+
+# name of reference data -> (source it is built from, loader given the source path)
+loaders = {
+    'name_dict': ('known_name_probs', load_name_dict),
+    'ref_master': ('ref_historical', load_ref_historical),
+}
+
+# name of reference data -> other sources it is built from (e.g. known_name_probs for cleaned names)
+depends = {}
+
+# name of reference data -> function returning a stamp of the code/rules the data is built with
+stamps = {}
+
+def register(name, source, loader, depends_on: list | None = None, stamp = None):
+    '''
+    Registers reference data name, built by loader from the file of source in paths.
+    Lets modules add compiled artifacts to the registry.
+    depends_on: other sources the data is built from -- the data is rebuilt when they change too.
+    stamp: optional function returning a string that changes with the code or rules 
+    the data is built with (e.g. name cleaning rules) -- the data is rebuilt when it changes.
+    '''
+    loaders[name] = (source, loader)
+    depends[name] = list(depends_on or [])
+    stamps[name] = stamp
+    loaded.pop(name, None)
+
+def set_path(source, path):
+    '''
+    Points source to a new file path and drops everything loaded from it.
+    Relative paths are resolved against the current working folder.
+    '''
+    paths[source] = os.path.abspath(path)
+    for name, (name_source, _) in loaders.items():
+        if name_source == source or source in depends.get(name, []):
+            loaded.pop(name, None)
+
+def cache_path(name):
+    '''
+    Returns path of binary cache of reference data name.
+    '''
+    path = paths[loaders[name][0]]
+    folder = cache_dir or os.path.dirname(path) or '.'
+    return f'{folder}/.{os.path.basename(path)}.{name}.pkl'
+
+def load(name):
+    '''
+    Loads reference data name from its binary cache if the cache was built from
+    the current version (mtime) of the source file (and of the sources it depends on)
+    and with the current stamp (see register), otherwise from the source file, refreshing the cache.
+    '''
+    source, loader = loaders[name]
+    path = paths[source]
+    for needed in [source] + depends.get(name, []):
+        if not os.path.exists(paths[needed]):
+            raise ValueError(f'{paths[needed]} not found -- use set_path("{needed}", ...) to point to it.')
+    mtime = tuple(os.path.getmtime(paths[needed]) for needed in [source] + depends.get(name, []))
+    stamp = stamps[name]() if stamps.get(name) else None
+    cache = cache_path(name)
+    if os.path.exists(cache):
+        try:
+            with open(cache, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['source'] == os.path.abspath(path) and cached['mtime'] == mtime and cached.get('stamp') == stamp:
+                return cached['value']
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # unreadable cache is rebuilt below
+            pass
+    value = loader(path)
+    try:
+        with open(cache, 'wb') as f:
+            pickle.dump({'source': os.path.abspath(path), 'mtime': mtime, 'stamp': stamp, 'value': value}, f)
+    except OSError:
+        # cache folder not writable -- keep going without a cache
+        pass
+    return value
+
+def get(name):
+    '''
+    Returns reference data name, loading it on first use in this process.
+    '''
+    if name not in loaded:
+        loaded[name] = load(name)
+    return loaded[name]
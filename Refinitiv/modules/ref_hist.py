@@ -7,9 +7,9 @@ import modules.title_tools as t_tools
 import time
 import re
 import datetime
+import modules.ref_data as ref_data
 
 univ = '/project/kh_mercury_1/refinitiv_univ/TRANSCRIPT/XML_Add_IDs/Archive'
-master = pd.read_csv('/project/kh_mercury_1/conference_call/xml_pulls/data_ref/Refinitiv_historical_web.csv', low_memory=False, index_col=0)
 
 def run_year(running_dups, yr):
     '''
@@ -33,6 +33,11 @@ def run_year(running_dups, yr):
     event_title: event subtitle of associated PDF 
     ref_firmname: firm name of company in associated PDF
     '''
+    # historical master is loaded on first run, see ref_data for its path
+    # its firm names are supercleaned once, see title_tools.add_clean_name_cols
+    master = ref_data.get('ref_master_clean')
+    # fuzzy scores of name pairs seen in earlier runs are reused, see title_tools.load_score_cache
+    t_tools.load_score_cache()
     os.chdir(univ)
     prev_year = yr-1
     next_year = yr+1
@@ -101,8 +106,8 @@ def run_year(running_dups, yr):
                     matched = True
                     break
                 #start fuzzy matching
-                #find unique set of possible names
-                firm_opts = set(subspace.firm_name)
+                #possible names with their precomputed cleaned columns
+                firm_opts = subspace
                 #compare_names runs fuzzy matching on firm_names and returns best firm name match, if it finds one with sufficient similarity
                 name_check = t_tools.compare_names(firm_name, firm_opts)
                 #if match is found with standard method:
@@ -140,4 +145,7 @@ def run_year(running_dups, yr):
     print(f'{yr} match rate: {round((dups/(total-govcount))*100, 3)}%\n')
     print(f'Year {yr} took {(time.time() - start_time)} seconds')
     print(f'Processed {total} files. Found {dups} duplicates, and {new} new files.\n')
+    print(f'Name cleaner cache hit rates:\n{t_tools.cache_stats().hit_rate.round(3).to_string()}\n')
+    t_tools.save_score_cache()
+    print(f'Name score cache: {t_tools.score_cache_stats()}\n')
     return [running_dups, pd.DataFrame(files_to_get, columns=['duplicate', 'folder_year', 'file_name', 'firm_id', 'firm_name', 'event_title', 'event_date', 'ref_ReportID', 'ref_title', 'ref_event_title', 'ref_firm_name'])]
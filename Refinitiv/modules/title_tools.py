@@ -1,9 +1,27 @@
+import os
+import pickle
+import hashlib
+import inspect
 import pandas as pd
 import re
-from fuzzywuzzy import process
+from functools import lru_cache
+from collections import OrderedDict
+import fuzzywuzzy
+from fuzzywuzzy import process, fuzz
+import modules.ref_data as ref_data
+import modules.rule_tables as rule_tables
 
-direc = '/project/kh_mercury_1/conference_call/xml_pulls/codebase/'
-name_dict = pd.read_csv(direc+'known_name_probs.csv', index_col=0).squeeze('columns').to_dict()
+# number of names kept by each memoized cleaner (superclean, xml_clean_title, ...)
+cache_size = 2**18
+
+def __getattr__(name):
+    '''
+    name_dict is loaded from known_name_probs.csv on first use instead of at import -- 
+    see ref_data to point to a different file.
+    '''
+    if name == 'name_dict':
+        return ref_data.get('name_dict')
+    raise AttributeError(f'module {__name__} has no attribute {name}')
 
 
 def clean_ref_body(txt):
@@ -14,8 +32,114 @@ def clean_ref_body(txt):
     added appropriately
     '''
     txt = re.sub(r'-{2,}', '', txt)
-    txt = re.sub(r',{0,}\s*\[[0-9]{0,}\]((.|\n)*?)(?=([A-Z]|[a-z]))', ': ', txt)
-    return txt
+    # same as re.sub(r',{0,}\s*\[[0-9]{0,}\]((.|\n)*?)(?=([A-Z]|[a-z]))', ': ', txt),
+    # which backtracks quadratically on long bodies
+    return replace_speaker_markers(txt)
+
+speaker_marker = re.compile(r'\[[0-9]*\]')
+ascii_letter = re.compile('[A-Za-z]')
+
+def replace_speaker_markers(txt):
+    '''
+    Single pass scanner replacing every speaker marker ([<digits>]) with ': ',
+    together with the commas and whitespace before it and everything up to the next letter.
+    Gives the same output as the regex in clean_ref_body in linear time.
+    '''
+    out = []
+    pos = 0
+    while True:
+        marker = speaker_marker.search(txt, pos)
+        if not marker:
+            break
+        letter = ascii_letter.search(txt, marker.end())
+        # no letter left -- neither this marker nor any later one is replaced
+        if not letter:
+            break
+        # match starts at the commas, then whitespace, right before the marker
+        start = marker.start()
+        while start > pos and txt[start-1].isspace():
+            start -= 1
+        while start > pos and txt[start-1] == ',':
+            start -= 1
+        out.append(txt[pos:start])
+        out.append(': ')
+        pos = letter.start()
+    out.append(txt[pos:])
+    return ''.join(out)
+
+def clean_ref_body_stream(chunks):
+    '''
+    Streaming version of clean_ref_body: given iterable of text chunks of a body,
+    yields cleaned text pieces that join to clean_ref_body of the whole body.
+    Text is cleaned up to the last letter of what has been read so far,
+    since neither cleaning step can reach across a letter.
+    '''
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        cut = len(buffer)
+        while cut > 0 and not ('A' <= buffer[cut-1] <= 'Z' or 'a' <= buffer[cut-1] <= 'z'):
+            cut -= 1
+        if cut:
+            yield clean_ref_body(buffer[:cut])
+            buffer = buffer[cut:]
+    if buffer:
+        yield clean_ref_body(buffer)
+
+# firm suffix rules of pdf_clean_title, in the order they are applied.
+# Rules of one stage run as a single regex, so a rule may only join a stage if it
+# cannot match text written or consumed by the other rules of that stage
+# (e.g. INC written before ORPORATION would make a new CORPORATION match).
+suffix_rules = [
+    [
+        ('INCORPORATED', 'INC'),
+        ('LIMITED PARTNERSHIP', 'LP'),
+    ],
+    [
+        ('CORPORATION', 'CORP'),
+        ('LIMITED', 'LTD'),
+        ('COMPANY', 'CO'),
+        ('AKTIENGESELLSCHAFT', 'AG'),
+    ],
+    [('INTERNATIONAL', 'INTL')],
+    [
+        (r'\sINTERN', ' INTL'),
+        (r'\sINDUSTRIES', ''),
+    ],
+    [('P L C', 'PLC')],
+    [('P.L.C', 'PLC')],
+    [('L.P', 'LP')],
+    [(r'\sL P', 'LP')],
+    [('S.P.A', 'SPA')],
+    [('S P A', 'SPA')],
+    [(r'\sSYSTEM\s', ' SYS ')],
+]
+suffix_table = rule_tables.compile_table(suffix_rules)
+
+def clean_unique(titles, cleaner):
+    '''
+    Given pandas Series of titles and a Series cleaner, cleans every unique title
+    once and returns Series of cleaned titles with the index of titles.
+    Missing titles stay missing.
+    '''
+    # python dictionary instead of pandas lookups, which mix up titles starting with \x00
+    unique = list(dict.fromkeys(titles.dropna()))
+    cleaned = dict(zip(unique, cleaner(pd.Series(unique, dtype=object))))
+    return titles.map(cleaned.__getitem__, na_action='ignore')
+
+# rules of pdf_clean_title applied after suffix_rules, in order
+pdf_title_rules = [
+    # Remove everything after firm name written in (...)
+    (r' \([A-Z].*', ''),
+    # Remove everything before firm name if it is "EVENT TRANSCRIPT OF"  or "EVENT BRIEF OF"
+    ('^.+EVENT TRANSCRIPT OF ', ''),
+    ('^.+EVENT BRIEF OF ', ''),
+    # Remove everything after "CONFERENCE"
+    (' CONF.+$', ''),
+    # Remove everything after firm name if it is " - PRELIM..." or " _ FINAL..."
+    (' - +.*', ''),
+]
+pdf_title_table = rule_tables.compile_table([[rule] for rule in pdf_title_rules])
 
 #cleaner function for pdf-based title cleaning
 def pdf_clean_title(title):
@@ -28,39 +152,58 @@ def pdf_clean_title(title):
     '''
     name = title.upper()
     # Use the same abbreviated firm suffix (e.g. incorporated to inc, corporation to corp, limited to ltd)
-    name = re.sub('INCORPORATED', 'INC', name)
-    name = re.sub('LIMITED PARTNERSHIP', 'LP', name)
-    name = re.sub('CORPORATION', 'CORP', name)
-    name = re.sub('LIMITED', 'LTD', name)
-    name = re.sub('COMPANY', 'CO', name)
-    name = re.sub('AKTIENGESELLSCHAFT', 'AG', name)
-    name = re.sub('INTERNATIONAL', 'INTL', name)
-    name = re.sub('\sINTERN', ' INTL', name)
-    name = re.sub('\sINDUSTRIES', '', name)
-    name = re.sub('P L C', 'PLC', name)
-    name = re.sub('P.L.C', 'PLC', name)
-    name = re.sub('L.P', 'LP', name)
-    name = re.sub('\sL P', 'LP', name)
-    name = re.sub('S.P.A', 'SPA', name)
-    name = re.sub('S P A', 'SPA', name)
-    name = re.sub('\sSYSTEM\s', ' SYS ', name)
-
-    # Remove everything after firm name written in (...)
-    name = re.sub(' \([A-Z].*', '', name)
-
-    # Remove everything before firm name if it is "EVENT TRANSCRIPT OF"  or "EVENT BRIEF OF"
-    name = re.sub('^.+EVENT TRANSCRIPT OF ', '', name)
-    name = re.sub('^.+EVENT BRIEF OF ', '', name)
+    name = rule_tables.apply_table(suffix_table, name)
 
-    # Remove everything after "CONFERENCE"
-    name = re.sub(' CONF.+$', '', name)
+    # Remove conference and event info, see pdf_title_rules
+    return rule_tables.apply_table(pdf_title_table, name)
 
-    # Remove everything after firm name if it is " - PRELIM..." or " _ FINAL..."
-    name = re.sub(' - +.*', '', name)
+def pdf_clean_title_series(titles):
+    '''
+    Series version of pdf_clean_title: given pandas Series of PDF titles,
+    returns Series of cleaned titles (same output, one pass of each rule over all unique titles).
+    '''
+    def clean(names):
+        names = rule_tables.apply_table_series(suffix_table, names.str.upper())
+        return rule_tables.apply_table_series(pdf_title_table, names)
+    return clean_unique(titles, clean)
 
-    return name
+# rules of xml_clean_title, in order
+xml_title_rules = [
+    (r'\*', ' '),
+    (r'Q[1-4]\s', ''),
+    (r'\sTHE\s|THE\s', ''),
+    (r'\.COM', ''),
+    (r'(FINAL\s|PRELIM|INTERIM\s|FULL\sYEAR|HALF\sYEAR|FY\s).*?[0-9]{4}\s', ''),
+    (r'(\sFINAL|\sPRELIM).*?RESULT', ''),
+    (r'[0-9]{4}(.*?)(?=[A-Z])', ''),
+    (r'\s-\s', ''),
+    (r'\sEARNINGS\s(.*)', ''),
+    (r'\sAT\s(.*)', ''),
+    (r'\sTO\s(.*)', ''),
+    (r'\sINVESTOR(.*)', ''),
+    (r'\sKEY PERFORMANCE(.*)', ''),
+    (r'\sCONFR(.*)', ''),
+    (r'\sCONFER(.*)', ''),
+    (r'\sANALYST(.*)', ''),
+    (r'\sMERGER\s(.*)', ''),
+    (r'\sVIDEO\s(.*)', ''),
+    (r'\sMANAG(.*)', ''),
+    (r'\sANNUAL\s(.*)', ''),
+    (r'\sFIRESIDE\s(.*)', ''),
+    (r'\sMIDTERM\s(.*)', ''),
+    (r'\sANNOUNCE(.*)', ''),
+    (r'\sDISCUSS(.*)', ''),
+    (r'\sCORPORATE\sS(.*)', ''),
+    (r'\sHOSTS\sS(.*)', ''),
+    (r'\s\'RESCHED(.*)', ''),
+    (r'\sAND\s[0-9]{4}\s(.*)', ''),
+    (r'\sAND\sYEAR-END{4}\s(.*)', ''),
+    (r'\sAUA\sAND\s(.*)', ''),
+]
+xml_title_table = rule_tables.compile_table([[rule] for rule in xml_title_rules])
 
 #cleaner function for xml-based title cleaning
+@lru_cache(maxsize=cache_size)
 def xml_clean_title(title):
     '''
     ***
@@ -70,81 +213,92 @@ def xml_clean_title(title):
     Returns cleaned title, which should be a firm name
     '''
     name = title.upper()
-    name = re.sub('\*', ' ', name)
-    name = re.sub('Q[1-4]\s', '', name)
-    name = re.sub('\sTHE\s|THE\s', '', name)
-    name = re.sub('\.COM', '', name)
-    name = re.sub('(FINAL\s|PRELIM|INTERIM\s|FULL\sYEAR|HALF\sYEAR|FY\s).*?[0-9]{4}\s', '', name)
-    name = re.sub('(\sFINAL|\sPRELIM).*?RESULT', '', name)
-    name = re.sub('[0-9]{4}(.*?)(?=[A-Z])', '', name)
-    name = re.sub('\s-\s', '', name)
-    name = re.sub('\sEARNINGS\s(.*)', '', name)
-    name = re.sub('\sAT\s(.*)', '', name)
-    name = re.sub('\sTO\s(.*)', '', name)
-    name = re.sub('\sINVESTOR(.*)', '', name)
-    name = re.sub('\sKEY PERFORMANCE(.*)', '', name)
-    name = re.sub('\sCONFR(.*)', '', name)
-    name = re.sub('\sCONFER(.*)', '', name)
-    name = re.sub('\sANALYST(.*)', '', name)
-    name = re.sub('\sMERGER\s(.*)', '', name)
-    name = re.sub('\sVIDEO\s(.*)', '', name)
-    name = re.sub('\sMANAG(.*)', '', name)
-    name = re.sub('\sANNUAL\s(.*)', '', name)
-    name = re.sub('\sFIRESIDE\s(.*)', '', name)
-    name = re.sub('\sMIDTERM\s(.*)', '', name)
-    name = re.sub('\sANNOUNCE(.*)', '', name)
-    name = re.sub('\sDISCUSS(.*)', '', name)
-    name = re.sub('\sCORPORATE\sS(.*)', '', name)
-    name = re.sub('\sHOSTS\sS(.*)', '', name)
-    name = re.sub('\s\'RESCHED(.*)', '', name)
-    name = re.sub('\sAND\s[0-9]{4}\s(.*)', '', name)
-    name = re.sub('\sAND\sYEAR-END{4}\s(.*)', '', name)
-    name = re.sub('\sAUA\sAND\s(.*)', '', name)
+    # Remove event info, see xml_title_rules
+    name = rule_tables.apply_table(xml_title_table, name)
 
     return name
 
+def xml_clean_title_series(titles):
+    '''
+    Series version of xml_clean_title: given pandas Series of event titles,
+    returns Series of cleaned titles (same output, one pass of each rule over all unique titles).
+    '''
+    return clean_unique(titles, lambda names: rule_tables.apply_table_series(xml_title_table, names.str.upper()))
+
 
-#very strict cleaner to maximize chance of matching
-def superclean(name):
+# firm suffixes removed from the end of names by superclean, in the order they are removed
+superclean_suffixes = [
+    'LLC', 'SPA', 'INC', 'CO', 'SA', 'AB', 'PLC', 'CORP', 'LTD', 'AG',
+    'ASA', 'AS', 'LP', 'NV', 'INTERNATIONAL', 'INTL', 'GROUP', 'GP', 'CAPITAL', 'CAP',
+    'REALTY', 'RLTY', 'AND',
+]
+superclean_suffix_table = rule_tables.compile_suffix_strip(superclean_suffixes)
+
+@lru_cache(maxsize=cache_size)
+def cached_superclean(name):
     '''
-    name: string of a firm name
-    Returns bare minimum string to represent the company. 
-    This is done by removing common suffixes (LLC, SPA, CO, SA, etc.), 
-    as well as some additional cleans encountered through testing
+    superclean without the name_dict check -- use superclean.
     '''
     name = pdf_clean_title(name)
     #use name discrepancy info to minimize problems
-    name = name_dict.get(name, name)
+    name = ref_data.get('name_dict').get(name, name)
     #Remove non-standard things such as periods,commas,slashes,etc.
     name = re.sub('[^\-a-zA-Z0-9_\s]', '', name)
 
     # Remove common firm suffixes
-    name = re.sub(' LLC\Z', '', name)
-    name = re.sub(' SPA\Z', '', name)
-    name = re.sub(' INC\Z', '', name)
-    name = re.sub(' CO\Z', '', name)
-    name = re.sub(' SA\Z', '', name)
-    name = re.sub(' AB\Z', '', name)
-    name = re.sub(' PLC\Z', '', name)
-    name = re.sub(' CORP\Z', '', name)
-    name = re.sub(' LTD\Z', '', name)
-    name = re.sub(' AG\Z', '', name)
-    name = re.sub(' ASA\Z', '', name)
-    name = re.sub(' AS\Z', '', name)
-    name = re.sub(' LP\Z', '', name)
-    name = re.sub(' NV\Z', '', name)
-    name = re.sub(' INTERNATIONAL\Z', '', name)
-    name = re.sub(' INTL\Z', '', name)
-    name = re.sub(' GROUP\Z', '', name)
-    name = re.sub(' GP\Z', '', name)
-    name = re.sub(' CAPITAL\Z', '', name)
-    name = re.sub(' CAP\Z', '', name)
-    name = re.sub(' REALTY\Z', '', name)
-    name = re.sub(' RLTY\Z', '', name)
-    name = re.sub(' AND\Z', '', name)
+    name = rule_tables.strip_suffixes(superclean_suffix_table, name)
     
     return name
 
+# name_dict the superclean cache was filled with
+superclean_name_dict = None
+
+#very strict cleaner to maximize chance of matching
+def superclean(name):
+    '''
+    name: string of a firm name
+    Returns bare minimum string to represent the company. 
+    This is done by removing common suffixes (LLC, SPA, CO, SA, etc.), 
+    as well as some additional cleans encountered through testing
+
+    Memoized: repeated names are a dictionary lookup. The cache is dropped
+    whenever name_dict is reloaded (e.g. after ref_data.set_path).
+    '''
+    global superclean_name_dict
+    name_dict = ref_data.get('name_dict')
+    if name_dict is not superclean_name_dict:
+        cached_superclean.cache_clear()
+        superclean_name_dict = name_dict
+    return cached_superclean(name)
+
+# memoized cleaners, by name
+memoized = {'superclean': cached_superclean, 'xml_clean_title': xml_clean_title}
+
+def cache_stats():
+    '''
+    Returns dataframe of hits, misses, size and hit rate of the cache of every memoized cleaner.
+    '''
+    stats = pd.DataFrame([cleaner.cache_info()._asdict() for cleaner in memoized.values()], index=list(memoized))
+    stats['hit_rate'] = stats.hits/(stats.hits+stats.misses).clip(lower=1)
+    return stats
+
+def clear_caches():
+    '''
+    Empties the cache of every memoized cleaner.
+    '''
+    for cleaner in memoized.values():
+        cleaner.cache_clear()
+
+# rules of clean_tickers, in order
+ticker_rules = [
+    (r'^\*.*?(?=[A-Z])', ''),
+    (r'\.[A-Z][^\.](.*)', ''),
+    (r'\.[A-Z]\Z', ''),
+    (r'^\d+$', ''),
+    (r'^[A-Z][0-9]{6}', ''),
+]
+ticker_table = rule_tables.compile_table([[rule] for rule in ticker_rules])
+
 #cleaner for tickers
 def clean_tickers(title):
     '''
@@ -155,19 +309,58 @@ def clean_tickers(title):
     more obvious
     '''
     nam = title.upper()
-    nam = re.sub('^\*.*?(?=[A-Z])', '', nam)
-    nam = re.sub('\.[A-Z][^\.](.*)', '', nam)
-    nam = re.sub('\.[A-Z]\Z', '', nam)
-    nam = re.sub('^\d+$', '', nam)
-    nam = re.sub('^[A-Z][0-9]{6}', '', nam)
+    nam = rule_tables.apply_table(ticker_table, nam)
 
     return nam
 
+def clean_tickers_series(titles):
+    '''
+    Series version of clean_tickers: given pandas Series of event titles,
+    returns Series of cleaned titles (same output, one pass of each rule over all unique titles).
+    '''
+    return clean_unique(titles, lambda names: rule_tables.apply_table_series(ticker_table, names.str.upper()))
+
+# columns add_clean_name_cols adds to master datasets
+clean_name_cols = ['cleaned', 'nospace', 'len']
+
+def add_clean_name_cols(master, name_col: str = 'firm_name'):
+    '''
+    Given master dataset, adds the columns basic_compare needs for every firm name
+    in name_col, so they are computed once instead of on every comparison:
+    cleaned: supercleaned firm name
+    nospace: cleaned without spaces
+    len: length of nospace
+    Rows with a missing firm name get missing values.
+    Returns master.
+    '''
+    names = master[name_col].dropna().unique()
+    cleaned = pd.Series([superclean(name) for name in names], index=names)
+    master['cleaned'] = master[name_col].map(cleaned).astype(object)
+    master['nospace'] = master.cleaned.str.replace(' ', '')
+    master['len'] = master.nospace.str.len()
+    return master
+
+# bump when the cleaning behind superclean changes in a way clean_rules_stamp cannot see
+clean_rules_version = 1
+
+def clean_rules_stamp():
+    '''
+    Returns stamp of the name cleaning rules and code behind superclean and add_clean_name_cols, 
+    so data built with them (cleaned master columns, cached scores) is rebuilt when they change.
+    '''
+    # only data that is the same in every process -- reprs of code objects hold memory addresses
+    parts = [clean_rules_version, suffix_rules, pdf_title_rules, superclean_suffixes]
+    for func in [pdf_clean_title, cached_superclean.__wrapped__, add_clean_name_cols]:
+        parts.append(inspect.getsource(func))
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
 #basic compare function to make fuzzy matching more efficient
-def basic_compare(str1, strs):
+def basic_compare(str1, strs, name_col: str = 'firm_name'):
     '''
     str1: string of firm name to be matched
-    strs: **unique** list of possible string matches
+    strs: **unique** list of possible string matches, or dataframe of them
+    with the columns of add_clean_name_cols (e.g. subspace of an enriched master)
+    name_col: column of firm names if strs is a dataframe
     returns a supercleaned version of str1 as well as a dataframe of 
     given strs with their cleaned counterparts
 
@@ -177,28 +370,161 @@ def basic_compare(str1, strs):
     str1 = superclean(str1)
     str1_nospace = str1.replace(' ', '')
     str1_len = len(str1_nospace)
-    strs = pd.DataFrame(strs, columns=['names'])
-    strs['cleaned'] = strs.names.apply(superclean)
-    strs['nospace'] = strs.cleaned.str.replace(' ', '')
-    strs['lens'] = strs.nospace.apply(len)
-    strs = strs[((str1_len -2) <= strs.lens) & (strs.lens <= (str1_len+2))]
+    if isinstance(strs, pd.DataFrame):
+        # precomputed columns, one row per firm name
+        strs = strs[[name_col]+clean_name_cols].dropna(subset=[name_col]).drop_duplicates(subset=name_col)
+        strs = strs.rename(columns={name_col: 'names'})
+    else:
+        strs = pd.DataFrame(strs, columns=['names'])
+        strs['cleaned'] = strs.names.apply(superclean)
+        strs['nospace'] = strs.cleaned.str.replace(' ', '')
+        strs['len'] = strs.nospace.apply(len)
+    strs = strs[((str1_len -2) <= strs['len']) & (strs['len'] <= (str1_len+2))]
     strs.set_index('cleaned', inplace=True)
     return [str1, strs[['names']]]
 
+# most (name, candidate) scores kept by the score cache -- the least recently used ones are dropped first
+score_cache_size = 2**21
+
+# on-disk cache of fuzzy scores of (cleaned name, cleaned candidate) pairs, filled by compare_names
+# once load_score_cache was called -- reruns only score new pairs.
+# Saved as an append-only log: a stamp, then batches of new scores.
+score_cache = {'path': None, 'stamp': None, 'scores': OrderedDict(), 'new': [], 'logged': None, 'hits': 0, 'misses': 0}
+
+def score_cache_stamp():
+    '''
+    Returns stamp of everything cached scores depend on: known_name_probs.csv (path and mtime),
+    the cleaning rules of superclean (see clean_rules_stamp) and the scorer version.
+    A cache saved with another stamp is dropped by load_score_cache.
+    '''
+    path = ref_data.paths['known_name_probs']
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    # fuzzywuzzy scores differently with and without python-Levenshtein
+    parts = [os.path.abspath(path), mtime, clean_rules_stamp(), 'fuzzywuzzy', fuzzywuzzy.__version__, fuzz.SequenceMatcher.__module__]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def score_cache_path():
+    '''
+    Returns default path of the score cache: next to known_name_probs.csv (or in ref_data.cache_dir).
+    '''
+    folder = ref_data.cache_dir or os.path.dirname(ref_data.paths['known_name_probs']) or '.'
+    return f'{folder}/.name_scores.pkl'
+
+def remember_score(scores, pair, score):
+    '''
+    Adds score of pair to the LRU dictionary scores, dropping the oldest ones above score_cache_size.
+    '''
+    scores[pair] = score
+    scores.move_to_end(pair)
+    while len(scores) > score_cache_size:
+        scores.popitem(last=False)
+
+def load_score_cache(path = None):
+    '''
+    Turns on the score cache of compare_names, loading the scores saved at path
+    (default score_cache_path()) if they were saved with the current score_cache_stamp.
+    '''
+    path = path or score_cache_path()
+    stamp = score_cache_stamp()
+    if score_cache['path'] == path and score_cache['stamp'] == stamp:
+        return
+    scores, logged = OrderedDict(), None
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                if pickle.load(f) == {'stamp': stamp}:
+                    size = os.fstat(f.fileno()).st_size
+                    count = 0
+                    while f.tell() < size:
+                        batch = pickle.load(f)
+                        count += len(batch)
+                        for pair, score in batch:
+                            remember_score(scores, pair, score)
+                    logged = count
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # unreadable (e.g. cut off) log keeps what was read and is rewritten on save
+            pass
+    score_cache.update({'path': path, 'stamp': stamp, 'scores': scores, 'new': [], 'logged': logged})
+
+def save_score_cache():
+    '''
+    Appends the scores computed since the last save to the score cache file.
+    The file is rewritten with only the kept scores instead if it has another stamp,
+    could not be read, or would hold more than twice score_cache_size scores.
+    '''
+    if score_cache['path'] is None:
+        return
+    path, new, logged = score_cache['path'], score_cache['new'], score_cache['logged']
+    try:
+        if logged is None or logged+len(new) > 2*score_cache_size:
+            tmp = path+'.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump({'stamp': score_cache['stamp']}, f)
+                pickle.dump(list(score_cache['scores'].items()), f)
+            os.replace(tmp, path)
+            score_cache['logged'] = len(score_cache['scores'])
+        elif new:
+            with open(path, 'ab') as f:
+                pickle.dump(new, f)
+            score_cache['logged'] = logged+len(new)
+        score_cache['new'] = []
+    except OSError:
+        # cache folder not writable -- keep going without saving
+        pass
+
+def score_cache_stats():
+    '''
+    Returns dictionary of hits, misses, hit rate and size of the score cache.
+    '''
+    hits, misses = score_cache['hits'], score_cache['misses']
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits/max(hits+misses, 1), 'size': len(score_cache['scores'])}
+
+def pair_scores(str1, choices):
+    '''
+    Given cleaned firm name and list of cleaned candidate names, returns list of
+    their fuzzy scores (the ones process.extractOne ranks by), looking up known
+    pairs in the score cache and only scoring new ones.
+    '''
+    scores = score_cache['scores']
+    unique = dict.fromkeys(choices)
+    missing = []
+    for choice in unique:
+        if (str1, choice) in scores:
+            scores.move_to_end((str1, choice))
+        else:
+            missing.append(choice)
+    score_cache['hits'] += len(unique)-len(missing)
+    score_cache['misses'] += len(missing)
+    if missing:
+        # same scoring as process.extractOne, without picking the best
+        for choice, score in process.extractWithoutOrder(str1, missing):
+            remember_score(scores, (str1, choice), score)
+            score_cache['new'].append(((str1, choice), score))
+    return [scores[(str1, choice)] for choice in choices]
+
 #fuzzy matching function
-def compare_names(str1, strs):
+def compare_names(str1, strs, name_col: str = 'firm_name'):
     '''
     str1: string of firm name to match
-    strs: **unique** list of possible string matches
+    strs: **unique** list of possible string matches, or dataframe of them
+    with the columns of add_clean_name_cols (see basic_compare)
+    Scores come from the score cache once load_score_cache was called.
     Returns True if fuzzy match had a >= 95% match, as well as
     the best match from strs
     '''
-    basic_res = basic_compare(str1, strs)
+    basic_res = basic_compare(str1, strs, name_col)
     str1 = basic_res[0]  
     strs_df = basic_res[1]
     if strs_df.shape[0] < 1:
         return [False]
-    best = process.extractOne(str1, list(strs_df.index))
+    if score_cache['path'] is None:
+        best = process.extractOne(str1, list(strs_df.index))
+    else:
+        # first choice with the highest score, as in process.extractOne
+        choices = list(strs_df.index)
+        scores = pair_scores(str1, choices)
+        best_i = max(range(len(choices)), key=scores.__getitem__)
+        best = (choices[best_i], scores[best_i])
     rating = True if best[1] >= 95 else False
     final = strs_df.loc[best[0]]
     res = final.values[0]
@@ -206,3 +532,7 @@ def compare_names(str1, strs):
         res = final['names'].iloc[0]
         
     return [rating, res]
+
+# historical master with the columns of add_clean_name_cols, rebuilt when the master, known_name_probs or the cleaning rules change
+ref_data.register('ref_master_clean', 'ref_historical', lambda path: add_clean_name_cols(ref_data.load_ref_historical(path)),
+                  depends_on=['known_name_probs'], stamp=clean_rules_stamp)
@@ -46,6 +46,17 @@ def get_xml_metas(ref_con, path):
     if act == 'delete':
         f.close()
         return False
+    metas = read_xml_metas(data, path)
+    f.close()
+    return metas
+
+def read_xml_metas(data, path):
+    '''
+    data: parsed refinitiv xml
+    path: path to the xml, for error messages
+    Returns cusip of company if there is one, firm name, 
+    event title, and date of event
+    '''
     date = pd.to_datetime(data.startDate.contents[0])
     firm_id = np.nan
     try:
@@ -59,9 +70,33 @@ def get_xml_metas(ref_con, path):
         firm_id = np.nan
     firm_name = data.companyName.contents[0]
     title = data.eventTitle.contents[0]
-    f.close()
     return [firm_id, firm_name, title, date]
 
+#gets xml meta info and transcript with a single parse
+def get_xml_record(ref_con, path):
+    '''
+    ref_con: sftp connection or None
+    path: path to the refinitiv xml within mercury 
+    Opens and parses the xml once, instead of once in get_xml_metas
+    and again in get_xml_body.
+    Returns dictionary with action of the xml (e.g. 'delete'), cusip of company 
+    if there is one, firm name, event title, date of event and transcript of call.
+    Deleted transcripts only have their action filled in.
+    '''
+    if ref_con:
+        f = ref_con.open(path)
+    else:
+        f = open(path)
+    data = bs(f, 'xml')
+    f.close()
+    record = {'action': data.EventStory.get('action'), 'cusip': None, 'firm_name': None,
+              'event_title': None, 'event_date': None, 'body': None}
+    if record['action'] == 'delete':
+        return record
+    record['cusip'], record['firm_name'], record['event_title'], record['event_date'] = read_xml_metas(data, path)
+    record['body'] = data.Body.text
+    return record
+
 #week-of-month buffer (defined as a week index assigned to day+-3)
 def get_buffer(date):
     '''
@@ -1,9 +1,22 @@
 import re
 import pandas as pd
 import os
+import hashlib
+import inspect
+import pickle
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import modules.ref_data as ref_data
 
-# Import keywords
-keywords = pd.read_csv('./data_ref/keywords.txt', sep = "\t", header = None)[0]
+def __getattr__(name):
+    '''
+    Keywords are loaded from data_ref on first use instead of at import -- 
+    see ref_data to point to a different keywords file.
+    '''
+    if name == 'keywords':
+        return ref_data.get('keywords')
+    raise AttributeError(f'module {__name__} has no attribute {name}')
 
 def mysplit(para):
     '''
@@ -25,21 +38,84 @@ def kw_search(kw, para):
    
     return re.search(pattern, para)
 
+# plain first word of a keyword (not followed by a quantifier), and a word of a paragraph
+first_word_pattern = re.compile(r'(\w+)(?:$|\s(?![?*+{]))')
+word_pattern = re.compile(r'\w+')
+
+def compile_keyword_matcher(keywords):
+    '''
+    Given list of keywords, returns a matcher that finds every keyword 
+    in a paragraph with a single scan. 
+    Keywords keep the same upper-cased \\b...\\b semantics as kw_search.
+    '''
+    keywords = list(keywords)
+    padder = r'\b'
+    # one pattern per keyword, used to confirm hits at candidate positions
+    patterns = [re.compile(padder+kw.upper()+padder) for kw in keywords]
+    # zero-width alternation that stops at every position where some keyword could start
+    alternation = '|'.join(f'(?:{kw.upper()})' for kw in keywords)
+    scanner = re.compile(f'(?={padder}(?:{alternation}){padder})')
+    # keywords by their plain first word -- only those can match where a paragraph word starts,
+    # the others (e.g. starting with a regex) are checked at every hit
+    by_first_word, other = {}, []
+    for i, kw in enumerate(keywords):
+        first = first_word_pattern.match(kw.upper())
+        if first and '|' not in kw:
+            by_first_word.setdefault(first.group(1), []).append(i)
+        else:
+            other.append(i)
+    return {'keywords': keywords, 'patterns': patterns, 'scanner': scanner,
+            'by_first_word': by_first_word, 'other': other}
+
+def find_keywords(matcher, para):
+    '''
+    Given matcher from compile_keyword_matcher and paragraph para, 
+    returns list of keywords found in para, in the order of the keyword list.
+    '''
+    keywords = matcher['keywords']
+    if not keywords:
+        return []
+    para = para.upper()
+    patterns, by_first_word, other = matcher['patterns'], matcher['by_first_word'], matcher['other']
+    found = [False]*len(keywords)
+    remaining = len(keywords)
+    for hit in matcher['scanner'].finditer(para):
+        pos = hit.start()
+        # several keywords can start at the same position, so check the ones
+        # starting with the word at pos that are left
+        word = word_pattern.match(para, pos)
+        for candidates in (by_first_word.get(word.group(), ()) if word else (), other):
+            for i in candidates:
+                if not found[i] and patterns[i].match(para, pos):
+                    found[i] = True
+                    remaining -= 1
+        if not remaining:
+            break
+    return [kw for kw, hit in zip(keywords, found) if hit]
+
+def keyword_matcher_stamp():
+    '''
+    Returns stamp of the layout of compile_keyword_matcher, so a saved matcher is rebuilt when it changes.
+    '''
+    return hashlib.sha1(inspect.getsource(compile_keyword_matcher).encode()).hexdigest()
+
+# compiled matcher of the keywords file, cached by ref_data
+ref_data.register('keyword_matcher', 'keywords', lambda path: compile_keyword_matcher(ref_data.load_keywords(path)),
+                  stamp=keyword_matcher_stamp)
+
 # helps split large paras
 def smart_split(para):
     ''' Helper function for check_and_fix_large_paras'''
     buffer = []
-    while len(para) > 32765:
-        end_ind = 32765
-        max_chunk = para[:end_ind]
-        rev = max_chunk[::-1]
-        end_search = re.search(r'\.', rev)
-        if end_search:
-            end_ind = len(max_chunk)-end_search.span()[1]+1
-        chunk = para[:end_ind]
-        buffer.append(chunk)
-        para = para[end_ind:]
-    buffer.append(para)
+    start = 0
+    while len(para) - start > 32765:
+        # cut after the last period within the max chunk if there is one
+        end_ind = para.rfind('.', start, start+32765) + 1
+        if not end_ind:
+            end_ind = start+32765
+        buffer.append(para[start:end_ind])
+        start = end_ind
+    buffer.append(para[start:])
     return buffer
 
 # splits max length paras into extra rows to stay within
@@ -54,93 +130,747 @@ def check_and_fix_large_paras(df):
     if not df.shape[0]:
         return df
     # find paragraphs whose char number is bigger than excel's limit
-    probs = df[df.Paragraph.str.len() >= 32767].copy()
+    too_large = df.Paragraph.str.len() >= 32767
     # enter correction loop if such paragraphs exist
-    if probs.shape[0] > 0:
+    if too_large.any():
         # save paragraphs whose char number is within limit
-        save = df[df.Paragraph.str.len() < 32767].copy()
-        # initialize dataframe used to fix issue
-        fixes = pd.DataFrame()
-        # start fixing the large paragraphs
-        for i, row in probs.iterrows():
-            # create array of smaller chunks of the paragraph
-            buffer = smart_split(row.Paragraph)
-            prob_fixes = pd.DataFrame()
-            # re attach fixed paragraphs
-            for i, chunk in enumerate(buffer):
-                new_row = row.copy()
-                new_row['Paragraph'] = chunk
-                prob_fixes = pd.concat([prob_fixes, new_row.to_frame().T], ignore_index=True)
-            
-            fixes = pd.concat([fixes, prob_fixes])
+        save = df[~too_large]
+        # split large paragraphs into chunks and give each chunk its own copy of the row
+        fixes = df[too_large].copy()
+        fixes['Paragraph'] = fixes.Paragraph.map(smart_split)
+        fixes = fixes.explode('Paragraph')
         return pd.concat([save, fixes], ignore_index=True)
     else:
         return df
 
+# percent/basis point signals, compiled once into a single pattern
+pc_bp_pattern = re.compile(r'%|per cent|percent|percentage|basis point|\bbp\b|\bbps\b')
+
 def paragraph_contains_pc_bp(para):
     ''' Given paragraph, returns true if 
     it contains % sign, per cent, percent, percentage, 
     basis point, bp, or bps.'''
-    padder = r'\b'
-    bp = padder+'bp'+padder
-    bps = padder+'bps'+padder
-    para = para.lower()
-    num_list = ["%", "per cent", "percent", "percentage", "basis point", bp, bps]
-    for i in num_list:
-        if re.search(i, para):
-            return True
-    return False
+    return bool(pc_bp_pattern.search(para.lower()))
 
-def get_all_paras_containing_keywords_from_a_conf_call(row, keywords, check_for_nums = True):
+def flag_pc_bp_paras(paras):
+    '''
+    Given dataframe of paragraphs, returns boolean series that is true 
+    for paragraphs containing a percent or basis point sign. 
+    Each paragraph is checked once, no matter how many keywords it matches, 
+    as one string operation over the whole column.
+    '''
+    return paras.Paragraph.str.lower().str.contains(pc_bp_pattern).astype(bool)
+
+def get_all_paras_containing_keywords_from_a_conf_call(row, keywords, check_for_nums = True, matcher = None):
     '''
     Given row in a dataframe of calls, returns expanded dataframe of \
     paragraphs from the call that have keywords. 
     Note: if check_for_nums is true (default), checks for a percent or basis point sign
     in a paragraph before adding it.
+
+    matcher: optional output of compile_keyword_matcher for keywords. 
+    Pass it in when calling this on many rows to avoid recompiling.
     '''
     # Split conference call into paragraphs.
     call = str(row["text"])
     paras_list = mysplit(call)
     found_keywords, found_in_paras = [], []
 
+    if matcher is None:
+        matcher = compile_keyword_matcher(keywords)
+
     file_name = row.file_name
     for para in paras_list:
-        for keyword in keywords:
-            # Check if keyword is in paragraph
-            if kw_search(keyword, para):
-                # if percent/number needs to exist, 
-                # check for those before adding
-                if check_for_nums:
-                    if paragraph_contains_pc_bp(para):
-                        found_keywords.append(keyword)
-                        found_in_paras.append(para)
-                    continue
-                # if no percent check, add
-                found_keywords.append(keyword)
-                found_in_paras.append(para)
+        # find all keywords in paragraph with one scan
+        para_keywords = find_keywords(matcher, para)
+        # if percent/number needs to exist, 
+        # check for those once before adding
+        if para_keywords and check_for_nums and not paragraph_contains_pc_bp(para):
+            continue
+        for keyword in para_keywords:
+            found_keywords.append(keyword)
+            found_in_paras.append(para)
     
     # Create df 
     # Note that found_keywords and found_in_paras are lists. report_id is an int, but it will be broadcasted to a list.
     df = pd.DataFrame({"Keyword": found_keywords, "Paragraph": found_in_paras, "file_name": file_name})
     return df 
 
-def get_all_paras_containing_keywords_from_a_csv_file(df_csv_file, check_for_nums = True):
+def split_calls_into_paras(df_csv_file):
+    '''
+    Given dataframe of transcripts with call text included, returns long-format 
+    dataframe with one row per paragraph and columns Paragraph and file_name.
+    Paragraphs are split and filtered the same way as mysplit, 
+    but for the whole text column at once.
+    '''
+    # empty transcripts have no paragraphs (a chunk of only empty ones reads in as a float column)
+    paras = pd.DataFrame({'Paragraph': df_csv_file['text'].fillna('').astype(str).str.split('\n|\n\r|\r', regex=True),
+                          'file_name': df_csv_file['file_name']})
+    paras = paras.explode('Paragraph', ignore_index=True)
+    return paras[paras.Paragraph.str.len() > 10].reset_index(drop=True)
+
+# stages timed by prepare_all_files for every file
+stat_stages = ['read', 'split', 'keyword_scan', 'numeric_filter', 'merge', 'large_para_split', 'dedup']
+
+def new_file_stats():
+    '''
+    Returns empty stats dictionary for one file: seconds per stage, 
+    and counts of paragraphs scanned, keyword hits, bytes of call text and paragraphs output.
+    '''
+    return {'seconds': dict.fromkeys(stat_stages, 0.0), 'paragraphs_scanned': 0, 'hits': 0, 'bytes': 0, 'paragraphs_out': 0}
+
+def add_stats(stats, other):
+    '''
+    Adds timings and counts of stats dictionary other into stats.
+    '''
+    for stage, secs in other['seconds'].items():
+        stats['seconds'][stage] += secs
+    for key in ['paragraphs_scanned', 'hits', 'bytes', 'paragraphs_out']:
+        stats[key] += other[key]
+
+def lap(stats, stage, start):
+    '''
+    Adds time since start to stage in stats (if stats is given) and returns current time.
+    '''
+    now = time.perf_counter()
+    if stats is not None:
+        stats['seconds'][stage] += now - start
+    return now
+
+def para_columns(flag_nums = False):
+    '''
+    Returns columns of extracted paragraphs, with the pc_bp flag if flag_nums is true.
+    '''
+    return ['Keyword', 'Paragraph', 'file_name'] + (['pc_bp'] if flag_nums else [])
+
+def get_all_paras_containing_keywords_from_a_csv_file(df_csv_file, check_for_nums = True, batched = True, stats = None, flag_nums = False):
     '''
     Given dataframe of transcripts with call text included, returns dataframe
     of paragraphs found with keywords -- as detailed in the data_ref folder. 
     
     Note: if check_for_nums is true (default), checks for a percent or basis point sign
     in a paragraph before adding it.
+
+    batched determines if the whole file is split and searched as columns (default), 
+    or one call at a time. Both return the same rows in the same order.
+
+    stats: optional dictionary from new_file_stats to add batched stage timings and counts to.
+
+    flag_nums: if true, keeps the paragraph-level percent/basis point flag in a pc_bp column 
+    (computed even when check_for_nums is false). Otherwise the flag is only computed 
+    to filter paragraphs when check_for_nums is true.
+    '''
+    matcher = ref_data.get('keyword_matcher')
+    if not batched:
+        df_combined = pd.DataFrame()
+        for _, row_conf_call in df_csv_file.iterrows():
+            df = get_all_paras_containing_keywords_from_a_conf_call(row_conf_call, matcher['keywords'], check_for_nums=check_for_nums, matcher=matcher)
+            df_combined = pd.concat([df_combined, df])
+        if flag_nums:
+            df_combined['pc_bp'] = flag_pc_bp_paras(df_combined) if df_combined.shape[0] else pd.Series(dtype=bool)
+        return df_combined
+
+    # split all calls into one long paragraph table
+    start = time.perf_counter()
+    paras = split_calls_into_paras(df_csv_file)
+    if stats is not None:
+        stats['paragraphs_scanned'] += paras.shape[0]
+        stats['bytes'] += int(df_csv_file['text'].fillna('').astype(str).str.encode('utf-8').str.len().sum())
+    start = lap(stats, 'split', start)
+    if not paras.shape[0]:
+        return pd.DataFrame(columns=para_columns(flag_nums))
+    # find keywords of every paragraph and keep paragraphs with hits
+    paras['Keyword'] = paras.Paragraph.map(lambda para: find_keywords(matcher, para))
+    paras = paras[paras.Keyword.str.len() > 0].copy()
+    start = lap(stats, 'keyword_scan', start)
+    # percent/basis point flag, computed once per paragraph before expanding hits
+    if check_for_nums or flag_nums:
+        paras['pc_bp'] = flag_pc_bp_paras(paras)
+    if check_for_nums:
+        paras = paras[paras.pc_bp]
+    start = lap(stats, 'numeric_filter', start)
+    # expand to one row per hit
+    paras = paras.explode('Keyword')
+    if stats is not None:
+        stats['hits'] += paras.shape[0]
+    return paras[para_columns(flag_nums)].reset_index(drop=True)
+
+
+
+def standardize_metadata(df, db):
+    '''
+    Given dataframe of transcript metadata (text column not needed) and name of database, 
+    renames and selects columns so every source has the same layout. 
+    Returns one row per transcript, in the same order as df.
+
+    db must be one of 'fs', 'ref', or 'ciq'.
+    '''
+    new_df = df.drop(columns='text', errors='ignore').reset_index(drop=True)
+    
+    # renames reformat to standardize columns
+    if db == 'fs':
+        # factset case
+        # rename columns
+        new_df.rename(columns={'Year': 'folder_year', 'ENTITY_PROPER_NAME': 'Firm_name', 'TITLE': 'Subtitle', 'EVENT_DATETIME_UTC': 'Date', 'ISO_COUNTRY': 'country'}, inplace=True)
+        # change report id to differentiate across sources
+        new_df['Report'] = 'fs_'+new_df.REPORT_ID.astype(str)
+        # add empty gvkey column since it does not exist
+        new_df['gvkey'] = ''
+    elif db == 'ref':
+        # refinitiv case
+        # rename columns
+        new_df.rename(columns={'firm_cusip': 'CUSIP', 'firm_id': 'CUSIP', 'cusip': 'CUSIP', 'firm_name': 'Firm_name', 'event_title': 'Subtitle', 'event_date': 'Date'}, inplace=True)
+        # get report id to differentiate across sources
+        new_df['Report'] = new_df.file_name.str.split('_').str[0]
+        # add empty gvkey column since it does not exist
+        new_df['gvkey'] = ''
+    else:
+        # capital iq case
+        # rename columns
+        new_df.rename(columns={'Year': 'folder_year', 'firm_name': 'Firm_name', 'event_title': 'Subtitle', 'event_date': 'Date'}, inplace=True)
+        # change report id to differentiate across sources
+        new_df['Report'] = 'ciq_'+new_df.transcriptid.astype(int).astype(str)
+        # add empty cusip column since it does not exist
+        new_df['CUSIP'] = ''
+    
+    # fix date type column
+    new_df['Date'] = pd.DatetimeIndex(new_df.Date).date
+    
+    # select only needed columns
+    return new_df[['file_name', 'folder_year', 'CUSIP', 'gvkey', 'Firm_name', 'Subtitle', 'Date', 'Report']]
+
+def output_columns(paras):
+    '''
+    Returns final column order of prepared paragraphs, 
+    keeping the pc_bp flag and paragraph fingerprints if they were added.
+    '''
+    columns = ['Keyword', 'Paragraph', 'file_name', 'folder_year', 'CUSIP', 'gvkey', 'Firm_name', 'Subtitle', 'Date', 'Report']
+    for col in ['pc_bp', 'fingerprint']:
+        if col in paras.columns:
+            columns.append(col)
+    return columns
+
+def standardize_paras(paras, df, db):
+    '''
+    Given dataframe of extracted paragraphs, dataframe of transcript metadata 
+    (text column not needed) and name of database, merges them and 
+    renames and selects columns so every source has the same layout.
+
+    db must be one of 'fs', 'ref', or 'ciq'.
+    '''
+    # merge paras with standardized transcript metadata dataset
+    new_df = paras.merge(standardize_metadata(df, db), on='file_name').reset_index(drop=True)
+    return new_df[output_columns(paras)]
+
+def transcript_calls(df, int_keys = False):
+    '''
+    Given dataframe of calls, returns its file_name and text columns for extraction. 
+    If int_keys is true, file_name is replaced by the row position of each call, 
+    which serves as a compact integer transcript id.
+    '''
+    if int_keys:
+        return pd.DataFrame({'file_name': range(df.shape[0]), 'text': df['text'].values})
+    return df[['file_name', 'text']]
+
+def join_transcript_dim(paras, dim):
+    '''
+    Given extracted paragraphs keyed by integer transcript id (see transcript_calls) 
+    and dimension table from standardize_metadata, returns prepared paragraphs 
+    with the metadata of each transcript looked up by position.
+    '''
+    new_df = dim.iloc[paras.file_name.values.astype(int)].reset_index(drop=True)
+    for col in paras.columns:
+        if col != 'file_name':
+            new_df[col] = paras[col].values
+    return new_df[output_columns(paras)]
+
+def fingerprint_paras(paras):
+    '''
+    Given dataframe of extracted paragraphs, returns series of 64-bit fingerprints 
+    over keyword, whitespace-normalized paragraph text and file_name (the report id).
+    '''
+    keys = pd.DataFrame({'Keyword': paras.Keyword.astype(str),
+                         'Paragraph': paras.Paragraph.str.replace(r'\s+', ' ', regex=True).str.strip(),
+                         'file_name': paras.file_name})
+    return pd.util.hash_pandas_object(keys, index=False)
+
+# paragraphs as mysplit returns them: runs of more than 10 characters between line breaks
+para_span_pattern = re.compile('[^\n\r]{11,}')
+
+def find_para_spans(df_csv_file, check_for_nums = True):
+    '''
+    Given dataframe of transcripts with call text included, returns dataframe of 
+    paragraph spans with keywords: file_name, start and end offsets into the call text, 
+    and a tuple of matched keywords in Keyword. 
+    Paragraph text is not stored -- use slice_spans to get it when needed.
+
+    Note: if check_for_nums is true (default), checks for a percent or basis point sign
+    in a paragraph before adding it.
+    '''
+    matcher = ref_data.get('keyword_matcher')
+    file_names, starts, ends, found_keywords = [], [], [], []
+    # empty transcripts have no paragraphs, as in the batched extraction
+    for file_name, call in zip(df_csv_file['file_name'], df_csv_file['text'].fillna('').astype(str)):
+        for span in para_span_pattern.finditer(call):
+            para = span.group()
+            para_keywords = find_keywords(matcher, para)
+            if not para_keywords or (check_for_nums and not paragraph_contains_pc_bp(para)):
+                continue
+            file_names.append(file_name)
+            starts.append(span.start())
+            ends.append(span.end())
+            found_keywords.append(tuple(para_keywords))
+    return pd.DataFrame({'file_name': file_names, 'start': starts, 'end': ends, 'Keyword': found_keywords})
+
+def slice_spans(spans, df_csv_file, context = 0):
+    '''
+    Given paragraph spans from find_para_spans and the dataframe of transcripts they 
+    came from, returns copy of spans with the Paragraph text sliced from the calls.
+    context: number of extra characters to include on each side of the paragraph.
+    '''
+    calls = dict(zip(df_csv_file['file_name'], df_csv_file['text'].fillna('').astype(str)))
+    spans = spans.copy()
+    spans['Paragraph'] = [calls[file_name][max(start-context, 0):end+context] 
+                          for file_name, start, end in zip(spans.file_name, spans.start, spans.end)]
+    return spans
+
+def group_keywords(paras):
+    '''
+    Given long-format dataframe of extracted paragraphs (one row per keyword hit), 
+    returns one row per paragraph with a tuple of its matched keywords in Keyword.
+    Hits of the same paragraph are consecutive in extraction output, 
+    so rows are grouped by runs of equal Paragraph and file_name.
+    '''
+    if not paras.shape[0]:
+        return paras
+    new_para = (paras.Paragraph != paras.Paragraph.shift()) | (paras.file_name != paras.file_name.shift())
+    grouped = paras.groupby(new_para.cumsum().values, sort=False)
+    new_df = pd.DataFrame({'Keyword': grouped.Keyword.agg(lambda kws: tuple(dict.fromkeys(kws))),
+                           'Paragraph': grouped.Paragraph.first(),
+                           'file_name': grouped.file_name.first()})
+    if 'pc_bp' in paras.columns:
+        new_df['pc_bp'] = grouped.pc_bp.first()
+    return new_df.reset_index(drop=True)
+
+def explode_keywords(df):
+    '''
+    Given dataframe with one row per paragraph and tuples of keywords in Keyword, 
+    returns the long format with one row per keyword hit.
+    '''
+    return df.explode('Keyword', ignore_index=True)
+
+# columns whose values repeat across many paragraph rows
+categorical_columns = ['Keyword', 'Firm_name', 'Subtitle', 'Report', 'folder_year']
+
+def categorize_paras(df):
+    '''
+    Given dataframe of prepared paragraphs, returns copy with repeating columns 
+    as categoricals and Date as datetime, which saves memory for large tables.
+    '''
+    df = df.copy()
+    # keywords grouped per paragraph are stored as lists instead of categories
+    grouped = 'Keyword' in df.columns and df.shape[0] > 0 and isinstance(df.Keyword.iloc[0], tuple)
+    if grouped:
+        df['Keyword'] = df.Keyword.map(list)
+    for col in categorical_columns:
+        if col in df.columns and not (grouped and col == 'Keyword'):
+            df[col] = df[col].astype('category')
+    if 'Date' in df.columns:
+        df['Date'] = pd.to_datetime(df.Date)
+    return df
+
+def save_paras_parquet(df, path):
+    '''
+    Saves dataframe of prepared paragraphs to parquet at path. 
+    Repeating columns are dictionary-encoded and Date is stored as a timestamp.
+    '''
+    categorize_paras(df).to_parquet(path, engine='pyarrow', index=False)
+
+def load_paras(path, columns = None):
+    '''
+    Loads paragraphs saved by save_paras_parquet or as csv. 
+    columns: optional list of columns to read -- with parquet only those columns are read from disk.
+    '''
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, engine='pyarrow', columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+def read_calls_file(filename, db, db_dir):
+    '''
+    Given transcript csv file name, name of database and its new_calls folder, 
+    returns dataframe of calls with a file_name column for every source.
     '''
-    df_combined = pd.DataFrame()
-    for _, row_conf_call in df_csv_file.iterrows():
-        df = get_all_paras_containing_keywords_from_a_conf_call(row_conf_call, keywords, check_for_nums=check_for_nums)
-        df_combined = pd.concat([df_combined, df])
-    return df_combined
+    # import calls dataset
+    df = pd.read_csv(f'./new_calls/{db_dir}/{filename}')
+    return set_file_name(df, db)
 
+def set_file_name(df, db):
+    '''
+    Given dataframe of calls and name of database, adds file_name column 
+    if source does not have one. Returns the same dataframe.
+    '''
+    # ciq is not file-based, so if source is ciq, 
+    # call the file name the report id for consistency across sources
+    if db == 'ciq':
+        df['file_name'] = 'transcriptid_'+df.transcriptid.astype(int).astype(str)
+    return df
+
+def transcript_hashes(df):
+    '''
+    Given dataframe of calls, returns series of sha1 hashes of each call text.
+    Missing texts (empty transcripts) are hashed as str() of the value, like the per-call extraction reads them.
+    '''
+    return df['text'].map(lambda text: hashlib.sha1(str(text).encode()).hexdigest())
+
+def load_para_cache(cache_dir, check_for_nums, flag_nums = False):
+    '''
+    Opens cache of earlier paragraph extractions in cache_dir. 
+    The cache is specific to the contents of the keywords file, to check_for_nums 
+    and to flag_nums, so changing any of them starts a new cache.
+
+    The cache is sharded on disk by transcript csv file, and a shard is only 
+    loaded while its file is processed (see open_para_cache_file), so memory 
+    depends on the size of a file rather than on the whole cache.
+
+    Returns dictionary with the cache folder, the cached paragraph columns 
+    and the open shards by file name.
+    '''
+    with open(ref_data.paths['keywords'], 'rb') as f:
+        key = f.read()+str(check_for_nums).encode()
+    if flag_nums:
+        key += b'pc_bp'
+    columns = ['Keyword', 'Paragraph'] + (['pc_bp'] if flag_nums else [])
+    return {'path': f'{cache_dir}/paras_{hashlib.sha1(key).hexdigest()}', 'columns': columns, 'shards': {}}
+
+def add_cached_paras(shard, hashes, paras):
+    '''
+    Given paragraph cache shard, text hashes of processed calls and their paragraphs 
+    (text_hash and the cached columns), adds them to the shard's hash set and paragraphs by hash.
+    '''
+    shard['hashes'].update(hashes)
+    rows = shard['paras']
+    for text_hash, *row in paras[['text_hash']+shard['columns']].itertuples(index=False, name=None):
+        rows.setdefault(text_hash, []).append(tuple(row))
+
+def open_para_cache_file(cache, filename):
+    '''
+    Given paragraph cache from load_para_cache and transcript csv file name, returns the cache shard 
+    of the file, loading it on first use: dictionary with the set of text hashes already processed, 
+    their paragraphs by hash and the extractions not saved yet. 
+    On disk, a shard is a log of (hashes, paragraphs) batches that new extractions are appended to.
+    '''
+    if filename in cache['shards']:
+        return cache['shards'][filename]
+    shard = {'path': f"{cache['path']}/{filename}.pkl", 'columns': cache['columns'], 'hashes': set(), 'paras': {}, 'new': [],
+             'rewrite': False}
+    if os.path.exists(shard['path']):
+        try:
+            with open(shard['path'], 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                while f.tell() < size:
+                    add_cached_paras(shard, *pickle.load(f))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # unreadable (e.g. cut off) log keeps what was read and is rewritten on save
+            shard['rewrite'] = True
+    cache['shards'][filename] = shard
+    return shard
+
+def save_para_cache_file(shard):
+    '''
+    Appends the new extractions of paragraph cache shard to its file, 
+    or rewrites the file with the whole shard if it could not be read.
+    '''
+    if not shard['new'] and not shard['rewrite']:
+        return
+    os.makedirs(os.path.dirname(shard['path']), exist_ok=True)
+    if shard['rewrite']:
+        rows = [(text_hash, *row) for text_hash, text_rows in shard['paras'].items() for row in text_rows]
+        tmp = shard['path']+'.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((list(shard['hashes']), pd.DataFrame(rows, columns=['text_hash']+shard['columns'])), f)
+        os.replace(tmp, shard['path'])
+    else:
+        with open(shard['path'], 'ab') as f:
+            for batch in shard['new']:
+                pickle.dump(batch, f)
+    shard['new'], shard['rewrite'] = [], False
+
+def close_para_cache_file(cache, filename):
+    '''
+    Saves the cache shard of transcript csv file filename and drops it from memory.
+    '''
+    shard = cache['shards'].pop(filename, None)
+    if shard is not None:
+        save_para_cache_file(shard)
+
+def save_para_cache(cache):
+    '''
+    Saves new extractions of every open shard of paragraph cache from load_para_cache to disk.
+    '''
+    for shard in cache['shards'].values():
+        save_para_cache_file(shard)
 
+def cache_miss_calls(df, hashes, shard):
+    '''
+    Given dataframe of calls, their text hashes and paragraph cache shard, returns calls 
+    not in the cache yet -- one per distinct text, with the hash as file_name.
+    '''
+    calls = pd.DataFrame({'file_name': hashes, 'text': df['text']})
+    known = shard['hashes']
+    return calls.loc[[text_hash not in known for text_hash in hashes]].drop_duplicates(subset='file_name')
+
+def add_to_para_cache(shard, hashes, paras):
+    '''
+    Given paragraph cache shard, text hashes of processed calls and paragraphs 
+    extracted from cache_miss_calls, adds new transcripts to the shard.
+    '''
+    known = shard['hashes']
+    new = [text_hash for text_hash in dict.fromkeys(hashes) if text_hash not in known]
+    if not new:
+        return
+    new_set = set(new)
+    paras = paras.rename(columns={'file_name': 'text_hash'})
+    paras = paras.loc[[text_hash in new_set for text_hash in paras.text_hash], ['text_hash']+shard['columns']]
+    add_cached_paras(shard, new, paras)
+    shard['new'].append((new, paras))
+
+def paras_from_cache(df, hashes, shard):
+    '''
+    Given dataframe of calls, their text hashes and paragraph cache shard containing all of them, 
+    returns extracted paragraphs (Keyword, Paragraph, file_name, and pc_bp if cached) in call order.
+    Only the paragraphs of the given calls are looked up, by hash.
+    '''
+    rows, file_names, found = shard['paras'], [], []
+    for text_hash, file_name in zip(hashes.values, df['file_name'].values):
+        text_rows = rows.get(text_hash, ())
+        found.extend(text_rows)
+        file_names.extend([file_name]*len(text_rows))
+    paras = pd.DataFrame(found, columns=shard['columns'])
+    paras['file_name'] = pd.Series(file_names, dtype=df['file_name'].dtype)
+    return paras[para_columns('pc_bp' in shard['columns'])]
+
+def get_all_paras_with_cache(df, check_for_nums, shard, stats = None, flag_nums = False):
+    '''
+    Cached version of get_all_paras_containing_keywords_from_a_csv_file. 
+    Only extracts paragraphs from calls whose text is not in the cache shard 
+    of their file (see open_para_cache_file), and reuses earlier extractions for the rest.
+    '''
+    hashes = transcript_hashes(df)
+    calls = cache_miss_calls(df, hashes, shard)
+    add_to_para_cache(shard, hashes, get_all_paras_containing_keywords_from_a_csv_file(calls, check_for_nums=check_for_nums, stats=stats,
+                                                                                       flag_nums=flag_nums))
+    return paras_from_cache(df, hashes, shard)
 
-def prepare_all_files(filenames: list,  db: str, suppress_print: bool = False, check_for_nums: bool = True):
+def extract_files(filenames, db, db_dir, check_for_nums, cache = None, int_keys = False, stats = None, flag_nums = False):
+    '''
+    Generator that reads each transcript csv file in turn and yields 
+    its name, calls dataframe and extracted paragraphs.
+    If cache from load_para_cache is given, unchanged transcripts are not processed again.
+    If int_keys is true, paragraphs are keyed by integer transcript id (see transcript_calls).
+    If stats dictionary is given, stats of each file are added under its name.
+    '''
+    for filename in filenames:
+        file_stats = None
+        if stats is not None:
+            file_stats = stats[filename] = new_file_stats()
+        start = time.perf_counter()
+        df = read_calls_file(filename, db, db_dir)
+        lap(file_stats, 'read', start)
+        calls = transcript_calls(df, int_keys)
+        if cache is None:
+            yield filename, df, get_all_paras_containing_keywords_from_a_csv_file(calls, check_for_nums=check_for_nums, stats=file_stats,
+                                                                                  flag_nums=flag_nums)
+        else:
+            shard = open_para_cache_file(cache, filename)
+            yield filename, df, get_all_paras_with_cache(calls, check_for_nums, shard, stats=file_stats, flag_nums=flag_nums)
+            close_para_cache_file(cache, filename)
+
+def pool_extract_files(pool, window, filenames, db, db_dir, check_for_nums, chunk_rows, cache = None, int_keys = False, stats = None,
+                       flag_nums = False):
+    '''
+    Process pool version of extract_files: yields the same name, calls metadata (text column dropped) 
+    and extracted paragraphs of each file, in file order.
+    Every file is extracted in chunk_rows-sized row chunks, with at most window chunks 
+    submitted to the pool at once, so pending futures only hold the text of those chunks. 
+    The window spans files: the next file is read and submitted while chunks of earlier files 
+    are pending, so lists of files smaller than chunk_rows are spread across the pool too.
+    '''
+    # files read and submitted but not yielded yet, oldest first, and their chunks in flight
+    files, in_flight = deque(), deque()
+    for filename in filenames:
+        file = {'name': filename, 'stats': None, 'futures': []}
+        if stats is not None:
+            file['stats'] = stats[filename] = new_file_stats()
+        start = time.perf_counter()
+        df = read_calls_file(filename, db, db_dir)
+        lap(file['stats'], 'read', start)
+        calls = transcript_calls(df, int_keys)
+        file['df'] = df.drop(columns='text')
+        del df
+        if cache is not None:
+            # only submit transcripts not in cache
+            file['shard'] = open_para_cache_file(cache, filename)
+            file['hashes'] = transcript_hashes(calls)
+            file['keys'] = calls[['file_name']]
+            calls = cache_miss_calls(calls, file['hashes'], file['shard'])
+        calls = calls[['file_name', 'text']]
+
+        for row in range(0, calls.shape[0], chunk_rows):
+            # wait on the oldest chunk whenever the window is full, yielding the files it completes
+            while len(in_flight) >= window:
+                in_flight.popleft().result()
+                yield from finished_files(files, cache, flag_nums)
+            future = pool.submit(extract_paras_with_stats, calls.iloc[row:row+chunk_rows], check_for_nums, stats is not None, flag_nums)
+            file['futures'].append(future)
+            in_flight.append(future)
+        del calls
+        # the file can only be yielded once all its chunks are submitted
+        files.append(file)
+        yield from finished_files(files, cache, flag_nums)
+
+    # collect the rest in file order
+    for file in files:
+        for future in file['futures']:
+            future.result()
+    yield from finished_files(files, cache, flag_nums)
+
+def finished_files(files, cache, flag_nums):
+    '''
+    Helper of pool_extract_files: yields name, calls metadata and paragraphs 
+    of the oldest files whose chunks are all done, in file order.
+    '''
+    while files and all(future.done() for future in files[0]['futures']):
+        file = files.popleft()
+        results = [future.result() for future in file['futures']]
+        if file['stats'] is not None:
+            for _, chunk_stats in results:
+                add_stats(file['stats'], chunk_stats)
+        paras = pd.concat([chunk for chunk, _ in results], ignore_index=True) if results else pd.DataFrame(columns=para_columns(flag_nums))
+        del results
+        if cache is not None:
+            add_to_para_cache(file['shard'], file['hashes'], paras)
+            paras = paras_from_cache(file['keys'], file['hashes'], file['shard'])
+            close_para_cache_file(cache, file['name'])
+        yield file['name'], file['df'], paras
+
+def init_pool_worker(matcher):
+    '''
+    Pool initializer: gives the worker the keyword matcher of the parent process, 
+    so it does not depend on ref_data settings (e.g. set_path) being inherited -- 
+    spawned workers start from a fresh import.
+    '''
+    ref_data.loaded['keyword_matcher'] = matcher
+
+def extract_paras_with_stats(df, check_for_nums, with_stats = False, flag_nums = False):
+    '''
+    Pool worker: returns extracted paragraphs of calls in df and their stats 
+    from new_file_stats (None unless with_stats is true).
+    '''
+    stats = new_file_stats() if with_stats else None
+    return get_all_paras_containing_keywords_from_a_csv_file(df, check_for_nums=check_for_nums, stats=stats, flag_nums=flag_nums), stats
+
+
+def append_unseen(new_df, seen, output_path):
+    '''
+    Appends rows of new_df not in seen (set of 64-bit row hashes) to the csv at output_path, 
+    writing the header only once, and adds their hashes to seen. 
+    Returns number of rows written.
+    '''
+    new_df = new_df.drop_duplicates()
+    # set lookups per row -- isin would turn all of seen into an array on every chunk
+    hashes = pd.util.hash_pandas_object(new_df, index=False).tolist()
+    new_df = new_df.loc[[h not in seen for h in hashes]]
+    seen.update(hashes)
+    new_df.to_csv(output_path, mode='a', header=not os.path.exists(output_path), index=False)
+    return new_df.shape[0]
+
+def stream_all_files(filenames, db, db_dir, output_path, check_for_nums = True, chunk_rows = 2000, suppress_print = False, cache = None,
+                     aggregate_keywords = False, stats = None, flag_nums = False):
+    '''
+    Streaming version of prepare_all_files. 
+    Reads each transcript csv file chunk_rows transcripts at a time, extracts and prepares 
+    paragraphs per chunk and appends them to the csv at output_path, so memory 
+    depends on chunk size rather than on the number of transcripts.
+
+    Duplicates are dropped within each file like in prepare_all_files, 
+    by keeping 64-bit hashes of rows already written for the current file.
+    Note: assumes a transcript's file_name is not repeated across chunks of a file.
+
+    Rows come out in the same order as prepare_all_files, whatever chunk_rows is: 
+    paragraphs too large for excel are split per chunk but held in a temporary file 
+    next to output_path and written after the rest of the file, as check_and_fix_large_paras orders them.
+
+    If cache from load_para_cache is given, unchanged transcripts are not processed again.
+    If aggregate_keywords is true, writes one row per paragraph (see group_keywords).
+    If stats dictionary is given, stats of each file are added under its name.
+    If flag_nums is true, keeps the pc_bp column (see get_all_paras_containing_keywords_from_a_csv_file).
+
+    Returns number of paragraphs written.
+    '''
+    if os.path.exists(output_path):
+        raise ValueError(f'{output_path} already exists -- pick a new output path.')
+
+    total = 0
+    large_path = output_path+'.large.tmp'
+    for filename in filenames:
+        seen = set()
+        file_total = 0
+        file_stats = None
+        if stats is not None:
+            file_stats = stats[filename] = new_file_stats()
+        shard = open_para_cache_file(cache, filename) if cache is not None else None
+        start = time.perf_counter()
+        for df in pd.read_csv(f'./new_calls/{db_dir}/{filename}', chunksize=chunk_rows):
+            df = set_file_name(df, db)
+            lap(file_stats, 'read', start)
+            if cache is None:
+                paras = get_all_paras_containing_keywords_from_a_csv_file(df, check_for_nums=check_for_nums, stats=file_stats, flag_nums=flag_nums)
+            else:
+                paras = get_all_paras_with_cache(df, check_for_nums, shard, stats=file_stats, flag_nums=flag_nums)
+            if aggregate_keywords:
+                paras = group_keywords(paras)
+            start = time.perf_counter()
+            new_df = standardize_paras(paras, df, db)
+            start = lap(file_stats, 'merge', start)
+            # split large paragraphs, keeping them aside until the end of the file
+            too_large = new_df.Paragraph.str.len() >= 32767
+            if too_large.any():
+                with open(large_path, 'ab') as f:
+                    pickle.dump(check_and_fix_large_paras(new_df[too_large]), f)
+                new_df = new_df[~too_large]
+            start = lap(file_stats, 'large_para_split', start)
+
+            # drop duplicates within chunk and against earlier chunks of the file, and append chunk to output
+            file_total += append_unseen(new_df, seen, output_path)
+            lap(file_stats, 'dedup', start)
+            # reading the next chunk starts now
+            start = time.perf_counter()
+
+        # write the split large paragraphs of the file last
+        if os.path.exists(large_path):
+            with open(large_path, 'rb') as f:
+                while True:
+                    try:
+                        file_total += append_unseen(pickle.load(f), seen, output_path)
+                    except EOFError:
+                        break
+            os.remove(large_path)
+        if cache is not None:
+            close_para_cache_file(cache, filename)
+        total += file_total
+        if file_stats is not None:
+            file_stats['paragraphs_out'] = file_total
+
+        if not suppress_print:
+            print(f'{filename} led to {file_total} paragraphs.')
+
+    return total
+
+
+def prepare_all_files(filenames: list,  db: str, suppress_print: bool = False, check_for_nums: bool = True, 
+                      workers: int | None = None, chunk_rows: int = 2000, output_path: str | None = None,
+                      cache_dir: str | None = None, aggregate_keywords: bool = False, hash_dedup: bool = False,
+                      int_keys: bool = False, return_stats: bool = False, flag_nums: bool = False):
     '''
         Given list of names of new transcript csv file names and name of database, \\
         extracts paragraphs, renames and prepares columns for paragraph division.
@@ -151,6 +881,45 @@ def prepare_all_files(filenames: list,  db: str, suppress_print: bool = False, c
 
         Note: if check_for_nums is true (default), checks for a percent or basis point sign
         in a paragraph before adding it.
+
+        workers: if larger than 1, paragraph extraction of all files is spread across 
+        a process pool of that size, in row chunks of chunk_rows transcripts (at most 2*workers chunks 
+        in flight at once, see pool_extract_files). 
+        Results are collected in file and row order, so the output is the same as the serial run.
+
+        output_path: if given, runs in streaming mode (see stream_all_files) -- transcripts are read 
+        chunk_rows at a time and paragraphs are appended to the csv at output_path. 
+        Returns number of paragraphs written instead of a dataframe (with stats if return_stats is true). 
+        Duplicates are dropped but not counted. Streaming runs serially and cannot be combined 
+        with workers, hash_dedup or int_keys (raises ValueError).
+
+        cache_dir: if given, extractions are cached there by transcript text hash, 
+        keywords file contents and check_for_nums, in one shard per transcript file 
+        (see load_para_cache). Reruns only process new or changed transcripts of a file.
+
+        aggregate_keywords: if true, returns one row per paragraph with a tuple of all matched 
+        keywords in Keyword, instead of one row per keyword hit. 
+        Use explode_keywords to get the long format back.
+
+        hash_dedup: if true, duplicates are dropped before the metadata merge using 
+        paragraph fingerprints (see fingerprint_paras) instead of comparing full rows afterwards. 
+        Either way, number of duplicates dropped per file is kept in the returned dataframe's 
+        attrs['duplicates'].
+
+        int_keys: if true, paragraphs are keyed by integer transcript ids during extraction 
+        and metadata is standardized once per transcript in a separate table, which is joined 
+        on the integer id by position instead of merging on file_name strings.
+
+        return_stats: if true, returns (dataframe, stats) where stats maps every file name to 
+        a json-serializable dictionary (see new_file_stats) of wall time per stage -- read, split, 
+        keyword_scan, numeric_filter, merge, large_para_split, dedup -- and counts of paragraphs 
+        scanned, keyword hits, bytes of call text and paragraphs output. 
+        With workers, extraction stage times are summed over pool workers.
+        Stats are only collected when return_stats is true.
+
+        flag_nums: if true, adds a pc_bp column that is true for paragraphs with a percent or 
+        basis point sign (all true when check_for_nums is true). Set check_for_nums to false 
+        to keep every keyword paragraph and filter on pc_bp later.
     '''
     # defend against unexpected db commands
     if db not in ['ref', 'fs', 'ciq']:
@@ -167,79 +936,109 @@ def prepare_all_files(filenames: list,  db: str, suppress_print: bool = False, c
         # check if files actually exist
         if not os.path.exists(f'./new_calls/{db_dir}/{filename}'):
             raise ValueError(f'{filename} not found in new_calls/{db_dir}.')
+    if output_path:
+        # options streaming mode does not support
+        unsupported = [name for name, value in [('workers', workers and workers > 1), ('hash_dedup', hash_dedup), ('int_keys', int_keys)] if value]
+        if unsupported:
+            raise ValueError(f"{', '.join(unsupported)} cannot be used with output_path (streaming mode).")
             
     if not suppress_print:
         print('Starting paragraph extraction...')
 
-    # initialize final dataframe
-    combined = pd.DataFrame()
-    # start process
-    for filename in filenames:
-        # import calls dataset
-        df = pd.read_csv(f'./new_calls/{db_dir}/{filename}')
-        
-        # ciq is not file-based, so if source is ciq, 
-        # call the file name the report id for consistency across sources
-        if db == 'ciq':
-            df['file_name'] = 'transcriptid_'+df.transcriptid.astype(int).astype(str)
-        
-        # extract paras and merge with transcript metadata dataset
-        new_df = get_all_paras_containing_keywords_from_a_csv_file(df, check_for_nums=check_for_nums).merge(df, on='file_name').drop(columns='text').reset_index(drop=True)
-        
-        # renames reformat to standardize columns
-        if db == 'fs':
-            # factset case
-            # rename columns
-            new_df.rename(columns={'Year': 'folder_year', 'ENTITY_PROPER_NAME': 'Firm_name', 'TITLE': 'Subtitle', 'EVENT_DATETIME_UTC': 'Date', 'ISO_COUNTRY': 'country'}, inplace=True)
-            # change report id to differentiate across sources
-            new_df['Report'] = 'fs_'+new_df.REPORT_ID.astype(str)
-            # add empty gvkey column since it does not exist
-            new_df['gvkey'] = ''
-        elif db == 'ref':
-            # refinitiv case
-            # rename columns
-            new_df.rename(columns={'firm_cusip': 'CUSIP', 'firm_id': 'CUSIP', 'cusip': 'CUSIP', 'firm_name': 'Firm_name', 'event_title': 'Subtitle', 'event_date': 'Date'}, inplace=True)
-            # get report id to differentiate across sources
-            new_df['Report'] = new_df.file_name.str.split('_').str[0]
-            # add empty gvkey column since it does not exist
-            new_df['gvkey'] = ''
-        else:
-            # capital iq case
-            # rename columns
-            new_df.rename(columns={'Year': 'folder_year', 'firm_name': 'Firm_name', 'event_title': 'Subtitle', 'event_date': 'Date'}, inplace=True)
-            # change report id to differentiate across sources
-            new_df['Report'] = 'ciq_'+new_df.transcriptid.astype(int).astype(str)
-            # add empty cusip column since it does not exist
-            new_df['CUSIP'] = ''
-        
-        # fix date type column
-        new_df['Date'] = pd.DatetimeIndex(new_df.Date).date
-        
-        # select only needed columns
-        new_df = new_df[['Keyword', 'Paragraph', 'file_name', 'folder_year', 'CUSIP', 'gvkey', 'Firm_name', 'Subtitle', 'Date', 'Report']]
-        
-        # split up very large paragraphs
-        try:
-            new_df = check_and_fix_large_paras(new_df)
-        except:
-            print('ffs')
-            return new_df
-        
-        # drop duplicates
-        new_df.drop_duplicates(inplace=True)
+    cache = load_para_cache(cache_dir, check_for_nums, flag_nums) if cache_dir else None
+    # per file stats, only collected when asked for
+    stats = {} if return_stats else None
 
-        if not suppress_print:
-            print(f'{filename} led to {new_df.shape[0]} paragraphs.')
+    if output_path:
+        total = stream_all_files(filenames, db, db_dir, output_path, check_for_nums=check_for_nums, 
+                                 chunk_rows=chunk_rows, suppress_print=suppress_print, cache=cache,
+                                 aggregate_keywords=aggregate_keywords, stats=stats, flag_nums=flag_nums)
+        if cache is not None:
+            save_para_cache(cache)
+        if return_stats:
+            return total, stats
+        return total
 
-        # add to overall dataframe
-        combined = pd.concat([combined, new_df]).reset_index(drop=True)
+    pool = None
+    if workers and workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_pool_worker, initargs=(ref_data.get('keyword_matcher'),))
+    if pool:
+        # spread row chunks of all files across the pool, with at most 
+        # two chunks per worker in flight so memory does not grow with the corpus
+        pending = pool_extract_files(pool, workers*2, filenames, db, db_dir, check_for_nums, chunk_rows, cache=cache, 
+                                     int_keys=int_keys, stats=stats, flag_nums=flag_nums)
+    else:
+        # read and extract one file at a time
+        pending = extract_files(filenames, db, db_dir, check_for_nums, cache=cache, int_keys=int_keys, stats=stats, flag_nums=flag_nums)
 
-    return combined
+    # initialize final dataframe and duplicate counts per file
+    combined = pd.DataFrame()
+    duplicates = {}
+    try:
+        # start process
+        for filename, df, paras in pending:
+            file_stats = stats[filename] if stats is not None else None
 
-    
+            # collapse keyword hits into one row per paragraph
+            if aggregate_keywords:
+                paras = group_keywords(paras)
+
+            dropped = 0
+            start = time.perf_counter()
+            if hash_dedup:
+                # drop repeated paragraphs by fingerprint before merging metadata onto them
+                paras = paras.assign(fingerprint=fingerprint_paras(paras).values)
+                found = paras.shape[0]
+                paras = paras.drop_duplicates(subset='fingerprint')
+                dropped += found - paras.shape[0]
+            start = lap(file_stats, 'dedup', start)
+
+            # merge with transcript metadata and standardize columns
+            if int_keys:
+                new_df = join_transcript_dim(paras, standardize_metadata(df, db))
+            else:
+                new_df = standardize_paras(paras, df, db)
+            start = lap(file_stats, 'merge', start)
 
-        
+            if hash_dedup:
+                # repeated metadata rows can still duplicate paragraphs, which fingerprints catch without the text
+                found = new_df.shape[0]
+                new_df = new_df.drop_duplicates(subset=[col for col in new_df.columns if col != 'Paragraph'])
+                new_df = new_df.drop(columns='fingerprint')
+                dropped += found - new_df.shape[0]
+            start = lap(file_stats, 'dedup', start)
+            
+            # split up very large paragraphs
+            try:
+                new_df = check_and_fix_large_paras(new_df)
+            except:
+                print('ffs')
+                return new_df
+            start = lap(file_stats, 'large_para_split', start)
+            
+            # drop duplicates
+            if not hash_dedup:
+                found = new_df.shape[0]
+                new_df.drop_duplicates(inplace=True)
+                dropped += found - new_df.shape[0]
+            lap(file_stats, 'dedup', start)
+            duplicates[filename] = dropped
+            if file_stats is not None:
+                file_stats['paragraphs_out'] = new_df.shape[0]
 
+            if not suppress_print:
+                print(f'{filename} led to {new_df.shape[0]} paragraphs.')
 
+            # add to overall dataframe
+            combined = pd.concat([combined, new_df]).reset_index(drop=True)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
 
+    if cache is not None:
+        save_para_cache(cache)
 
+    combined.attrs['duplicates'] = duplicates
+    if return_stats:
+        return combined, stats
+    return combined
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import random
+import tempfile
+import pandas as pd
+import modules.find_paras as fp
+import modules.ref_data as ref_data
+
+filler = ('the we our in of and to for a that this quarter year growth revenue margin business '
+          'customers market expect continue results strong team operating cash flow guidance').split()
+pc_bp_signals = ['5%', '12 percent', '3 per cent', '25 basis points', '40 bps', '10 bp']
+
+def make_paragraph(rng, words, kws, keyword_density, pc_bp_rate):
+    '''
+    Returns one synthetic paragraph of roughly words words, drawing keywords from kws.
+    keyword_density: chance of each sentence containing a keyword.
+    pc_bp_rate: chance of the paragraph containing a percent or basis point sign.
+    '''
+    sentences = []
+    while sum(len(s.split()) for s in sentences) < words:
+        sentence = [rng.choice(filler) for _ in range(rng.randint(6, 18))]
+        if rng.random() < keyword_density:
+            sentence.insert(rng.randrange(len(sentence)), rng.choice(kws))
+        sentences.append(' '.join(sentence).capitalize()+'.')
+    if rng.random() < pc_bp_rate:
+        sentences.insert(rng.randrange(len(sentences)), f'That is {rng.choice(pc_bp_signals)} higher.')
+    return ' '.join(sentences)
+
+def make_synthetic_calls(n_calls: int = 200, paras_per_call: int = 40, keyword_density: float = 0.05,
+                         pc_bp_rate: float = 0.3, large_para_rate: float = 0.002, empty_every: int = 50, seed: int = 0):
+    '''
+    Returns dataframe of synthetic transcripts with the columns of a Capital IQ
+    new_calls file (transcriptid, gvkey, Year, firm_name, event_title, event_date, text).
+
+    paras_per_call: number of paragraphs in each call.
+    keyword_density: chance of each sentence containing a keyword.
+    pc_bp_rate: chance of each paragraph containing a percent or basis point sign.
+    large_para_rate: chance of each paragraph being longer than excel's character limit.
+    empty_every: every empty_every-th call has an empty transcript (missing text once written to csv).
+    '''
+    rng = random.Random(seed)
+    kws = [str(kw) for kw in fp.keywords]
+    rows = []
+    for i in range(n_calls):
+        paras = []
+        for _ in range(paras_per_call):
+            words = 7000 if rng.random() < large_para_rate else rng.randint(20, 120)
+            paras.append(make_paragraph(rng, words, kws, keyword_density, pc_bp_rate))
+        date = pd.Timestamp('2020-01-01') + pd.Timedelta(days=rng.randrange(1500))
+        rows.append([100000+i, 1000+i % 97, date.year, f'Firm {i % 97} Inc', f'Firm {i % 97} Inc, Q{date.quarter} {date.year} Earnings Call',
+                     date.strftime('%Y-%m-%d'), '' if empty_every and i % empty_every == empty_every-1 else '\n'.join(paras)])
+    return pd.DataFrame(rows, columns=['transcriptid', 'gvkey', 'Year', 'firm_name', 'event_title', 'event_date', 'text'])
+
+def timed(func, *args, **kwargs):
+    '''
+    Runs func and returns its result and wall time in seconds.
+    '''
+    start = time.perf_counter()
+    res = func(*args, **kwargs)
+    return res, time.perf_counter() - start
+
+def run_benchmarks(n_calls: int = 200, seed: int = 0, suppress_print: bool = False, **synthetic_kwargs):
+    '''
+    Times mysplit, keyword search, check_and_fix_large_paras and prepare_all_files
+    (fresh and against a filled extraction cache) on synthetic transcripts from make_synthetic_calls.
+    Returns dictionary of stage name to seconds, transcripts/sec and MB/sec.
+    '''
+    calls = make_synthetic_calls(n_calls=n_calls, seed=seed, **synthetic_kwargs)
+    calls['file_name'] = 'transcriptid_'+calls.transcriptid.astype(str)
+    mb = calls.text.str.len().sum()/1e6
+    # keyword matcher is loaded (and cached by ref_data) before moving to the scratch folder below
+    matcher = ref_data.get('keyword_matcher')
+
+    stages = {}
+    paras, stages['mysplit'] = timed(lambda: [p for text in calls.text for p in fp.mysplit(text)])
+    _, stages['keyword_search'] = timed(lambda: [fp.find_keywords(matcher, p) for p in paras])
+    large = pd.DataFrame({'Keyword': 'bench', 'Paragraph': paras, 'file_name': 'bench'})
+    _, stages['check_and_fix_large_paras'] = timed(fp.check_and_fix_large_paras, large)
+
+    # end to end run from a scratch project folder
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(f'{tmp}/new_calls/CapitalIQ')
+        calls.drop(columns='file_name').to_csv(f'{tmp}/new_calls/CapitalIQ/bench_calls.csv', index=False)
+        os.chdir(tmp)
+        try:
+            _, stages['prepare_all_files'] = timed(fp.prepare_all_files, ['bench_calls.csv'], 'ciq', suppress_print=True)
+            # rerun against a filled extraction cache
+            fp.prepare_all_files(['bench_calls.csv'], 'ciq', suppress_print=True, cache_dir=f'{tmp}/cache')
+            _, stages['prepare_all_files_cached'] = timed(fp.prepare_all_files, ['bench_calls.csv'], 'ciq', suppress_print=True,
+                                                          cache_dir=f'{tmp}/cache')
+        finally:
+            os.chdir(cwd)
+
+    results = {}
+    for stage, secs in stages.items():
+        results[stage] = {'seconds': secs, 'transcripts_per_sec': n_calls/secs, 'mb_per_sec': mb/secs}
+        if not suppress_print:
+            print(f'{stage}: {secs:.3f}s, {n_calls/secs:.1f} transcripts/sec, {mb/secs:.2f} MB/sec')
+    return results
+
+def save_baseline(results, path):
+    '''
+    Saves benchmark results from run_benchmarks as json baseline at path.
+    '''
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+def compare_to_baseline(results, path, tolerance: float = 0.2, suppress_print: bool = False):
+    '''
+    Compares benchmark results to the baseline saved at path.
+    Returns list of stages more than tolerance (fraction) slower than the baseline.
+    '''
+    with open(path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for stage, res in results.items():
+        if stage not in baseline:
+            continue
+        ratio = res['seconds']/baseline[stage]['seconds']
+        if ratio > 1+tolerance:
+            regressions.append(stage)
+        if not suppress_print:
+            print(f'{stage}: {ratio:.2f}x baseline time' + (' -- REGRESSION' if ratio > 1+tolerance else ''))
+    return regressions
+
+if __name__ == '__main__':
+    # run from the project folder: python -m modules.para_bench
+    baseline_path = './data_ref/para_bench_baseline.json'
+    results = run_benchmarks()
+    if os.path.exists(baseline_path):
+        compare_to_baseline(results, baseline_path)
+    else:
+        save_baseline(results, baseline_path)
+        print(f'Saved baseline to {baseline_path}')
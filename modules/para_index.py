@@ -0,0 +1,171 @@
+import re
+import os
+import hashlib
+import pickle
+import numpy as np
+import pandas as pd
+import modules.find_paras as fp
+
+# keywords made only of these characters are matched literally by kw_search,
+# so their word tokens can be looked up in the index
+literal_keyword = re.compile(r"[\w\s\-'&]+")
+token_pattern = re.compile(r'\w+')
+
+def tokenize(para):
+    '''
+    Returns set of upper-cased word tokens in paragraph para.
+    '''
+    return set(token_pattern.findall(para.upper()))
+
+def token_bucket(token):
+    '''
+    Returns bucket of word token (one of 256, by hash of the token) -- 
+    the postings of every bucket are saved in their own file.
+    '''
+    return hashlib.sha1(token.encode()).hexdigest()[:2]
+
+def build_para_index(filenames: list, db: str, index_path: str, suppress_print: bool = False):
+    '''
+    Given list of transcript csv file names and name of database, splits every
+    transcript into paragraphs once and saves an inverted index of them in the folder index_path.
+
+    db must be one of 'fs', 'ref', or 'ciq'.
+
+    The index is sharded so queries only load the parts they need:
+    meta.pkl: the indexed file names and the id of the first paragraph of every file
+    paras_<i>.pkl: paragraph table (Paragraph, file_name) of the i-th file
+    pc_bp.npy: percent/basis point flag of every paragraph (memory-mapped on load)
+    postings_<bucket>.pkl: posting lists of paragraph ids of the word tokens 
+    of a bucket (see token_bucket), appended file by file
+    Only one file is held in memory while building.
+    Returns the index as loaded by load_para_index (empty if filenames is empty).
+    '''
+    if db not in ['ref', 'fs', 'ciq']:
+        raise ValueError(f"{db} is not a valid database name.\ndb must be one of 'fs', 'ref', or 'ciq'")
+    db_dir = {'ref': 'Refinitiv', 'fs': 'FactSet', 'ciq': 'CapitalIQ'}[db]
+    if os.path.exists(index_path):
+        raise ValueError(f'{index_path} already exists -- pick a new index path.')
+    os.makedirs(index_path)
+
+    offsets, pc_bp = [0], []
+    for file_id, filename in enumerate(filenames):
+        df = fp.read_calls_file(filename, db, db_dir)
+        paras = fp.split_calls_into_paras(df)
+        del df
+        paras.to_pickle(f'{index_path}/paras_{file_id}.pkl')
+        pc_bp.append(fp.flag_pc_bp_paras(paras).values if paras.shape[0] else np.array([], dtype=bool))
+
+        # token -> paragraph id postings of the file, appended to the postings file of each token's bucket
+        postings = {}
+        for para_id, para in enumerate(paras.Paragraph, start=offsets[-1]):
+            for token in tokenize(para):
+                postings.setdefault(token, []).append(para_id)
+        buckets = {}
+        for token, ids in postings.items():
+            buckets.setdefault(token_bucket(token), {})[token] = np.array(ids, dtype=np.int32)
+        for bucket, bucket_postings in buckets.items():
+            with open(f'{index_path}/postings_{bucket}.pkl', 'ab') as f:
+                pickle.dump(bucket_postings, f)
+        offsets.append(offsets[-1]+paras.shape[0])
+        if not suppress_print:
+            print(f'{filename} indexed.')
+
+    # no files give an empty index
+    np.save(f'{index_path}/pc_bp.npy', np.concatenate(pc_bp) if pc_bp else np.array([], dtype=bool))
+    pd.to_pickle({'files': list(filenames), 'offsets': np.array(offsets, dtype=np.int64)}, f'{index_path}/meta.pkl')
+    return load_para_index(index_path)
+
+def load_para_index(index_path: str):
+    '''
+    Opens paragraph index saved by build_para_index. Only the file list and offsets are read 
+    and the pc_bp flags memory-mapped -- postings and paragraph tables are loaded 
+    on first use by a query (see token_postings and para_file) and kept in the returned dictionary.
+    '''
+    if not os.path.exists(f'{index_path}/meta.pkl'):
+        raise ValueError(f'{index_path} not found -- build it with build_para_index.')
+    meta = pd.read_pickle(f'{index_path}/meta.pkl')
+    # an empty array cannot be memory-mapped
+    pc_bp = np.load(f'{index_path}/pc_bp.npy', mmap_mode='r' if meta['offsets'][-1] else None)
+    return {'path': index_path, 'files': meta['files'], 'offsets': meta['offsets'], 'pc_bp': pc_bp, 'postings': {}, 'paras': {}}
+
+def token_postings(index, token):
+    '''
+    Returns array of ids of paragraphs containing word token (None if there are none), 
+    loading the postings file of its bucket on first use.
+    '''
+    bucket = token_bucket(token)
+    if bucket not in index['postings']:
+        postings = {}
+        path = f"{index['path']}/postings_{bucket}.pkl"
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                while f.tell() < size:
+                    for bucket_token, ids in pickle.load(f).items():
+                        postings.setdefault(bucket_token, []).append(ids)
+        index['postings'][bucket] = {bucket_token: np.concatenate(ids) for bucket_token, ids in postings.items()}
+    return index['postings'][bucket].get(token)
+
+def para_file(index, file_id):
+    '''
+    Returns arrays of the paragraphs and file_name column of the file_id-th indexed file, 
+    loading its paragraph table on first use.
+    '''
+    if file_id not in index['paras']:
+        paras = pd.read_pickle(f"{index['path']}/paras_{file_id}.pkl")
+        index['paras'][file_id] = (paras.Paragraph.values, paras.file_name.values)
+    return index['paras'][file_id]
+
+def candidate_paras(index, keyword):
+    '''
+    Returns array of ids of paragraphs that may contain keyword.
+    Literal keywords only return paragraphs containing all of their tokens,
+    other keywords return every paragraph.
+    '''
+    tokens = token_pattern.findall(keyword.upper())
+    if not tokens or not literal_keyword.fullmatch(keyword):
+        return np.arange(index['offsets'][-1])
+    ids = None
+    for token in tokens:
+        postings = token_postings(index, token)
+        if postings is None:
+            return np.array([], dtype=np.int32)
+        ids = postings if ids is None else np.intersect1d(ids, postings, assume_unique=True)
+    return ids
+
+def query_para_index(index, keywords, check_for_nums: bool = True):
+    '''
+    Given paragraph index and list of keywords, returns dataframe of
+    (Keyword, Paragraph, file_name) rows for paragraphs containing keywords,
+    the same rows and order get_all_paras_containing_keywords_from_a_csv_file
+    returns on the indexed transcripts.
+
+    Note: if check_for_nums is true (default), only keeps paragraphs
+    with a percent or basis point sign.
+    '''
+    keywords = list(keywords)
+    offsets = index['offsets']
+    allowed = index['pc_bp'] if check_for_nums else None
+    hit_ids, hit_kws = [], []
+    for kw_idx, keyword in enumerate(keywords):
+        pattern = re.compile(r'\b'+keyword.upper()+r'\b')
+        ids = candidate_paras(index, keyword)
+        if allowed is not None:
+            ids = ids[allowed[ids]]
+        # confirm candidates with the same check as kw_search, loading only the files they are in
+        file_ids = np.searchsorted(offsets, ids, side='right')-1
+        ids = [i for i, file_id in zip(ids.tolist(), file_ids.tolist())
+               if pattern.search(para_file(index, file_id)[0][i-offsets[file_id]].upper())]
+        hit_ids.extend(ids)
+        hit_kws.extend([kw_idx]*len(ids))
+
+    # order hits by paragraph, then by keyword list order
+    hits = pd.DataFrame({'para_id': hit_ids, 'kw_idx': hit_kws}, dtype=int).sort_values(['para_id', 'kw_idx'])
+    texts, file_names = [], []
+    for para_id, file_id in zip(hits.para_id.tolist(), (np.searchsorted(offsets, hits.para_id.values, side='right')-1).tolist()):
+        paras, names = para_file(index, file_id)
+        texts.append(paras[para_id-offsets[file_id]])
+        file_names.append(names[para_id-offsets[file_id]])
+    return pd.DataFrame({'Keyword': [keywords[i] for i in hits.kw_idx],
+                         'Paragraph': texts,
+                         'file_name': file_names})
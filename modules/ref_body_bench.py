@@ -0,0 +1,60 @@
+import re
+import time
+import modules.title_tools as t_tools
+
+def regex_clean_ref_body(txt):
+    '''
+    Original regex implementation of title_tools.clean_ref_body, kept as reference.
+    '''
+    txt = re.sub(r'-{2,}', '', txt)
+    txt = re.sub(r',{0,}\s*\[[0-9]{0,}\]((.|\n)*?)(?=([A-Z]|[a-z]))', ': ', txt)
+    return txt
+
+def make_worst_case_bodies(n_chars: int = 5000):
+    '''
+    Returns dictionary of case name to transcript body of roughly n_chars characters.
+    The regex retries its lazy (.|\\n)*? scan from every start position, so bodies
+    with long marker prefixes or no letter after the markers are its worst cases.
+    '''
+    speech = ('Good morning and thank you for joining us. Revenue grew 5% in the quarter, '
+              'and margins were up 40 basis points.\n')
+    block = '-'*40 + '\nJohn Smith, Acme Corp - CEO [{}]\n' + '-'*40 + '\n' + speech*3
+    typical = ''.join(block.format(i) for i in range(n_chars//len(block)+1))
+    return {
+        'typical': typical,
+        # long run of whitespace before a marker with nothing but numbers after it
+        'whitespace_before_marker': 'Operator' + ' '*n_chars + '[1]' + ' 2024 '*10,
+        # many markers, none followed by a letter
+        'markers_without_letters': '[1] 2, '*(n_chars//7),
+        # long stretch of punctuation between every marker and the next letter
+        'long_gap_to_letter': ('[1]' + ' .'*(n_chars//20) + '\nOperator ')*10,
+    }
+
+def run_benchmarks(n_chars: int = 5000, suppress_print: bool = False):
+    '''
+    Times the regex and scanner versions of clean_ref_body on the bodies of
+    make_worst_case_bodies, and checks they give the same output.
+    Returns dictionary of case name to seconds taken by each version.
+    '''
+    results = {}
+    for case, body in make_worst_case_bodies(n_chars).items():
+        start = time.perf_counter()
+        expected = regex_clean_ref_body(body)
+        regex_secs = time.perf_counter() - start
+        start = time.perf_counter()
+        cleaned = t_tools.clean_ref_body(body)
+        scanner_secs = time.perf_counter() - start
+        if cleaned != expected:
+            raise ValueError(f'clean_ref_body output differs from the regex on {case}')
+        streamed = ''.join(t_tools.clean_ref_body_stream(body[i:i+1000] for i in range(0, len(body), 1000)))
+        if streamed != expected:
+            raise ValueError(f'clean_ref_body_stream output differs from the regex on {case}')
+        results[case] = {'regex_seconds': regex_secs, 'scanner_seconds': scanner_secs}
+        if not suppress_print:
+            print(f'{case}: regex {regex_secs:.4f}s, scanner {scanner_secs:.4f}s '
+                  f'({regex_secs/max(scanner_secs, 1e-9):.0f}x)')
+    return results
+
+if __name__ == '__main__':
+    # run from the project folder: python -m modules.ref_body_bench
+    run_benchmarks()
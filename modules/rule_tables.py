@@ -0,0 +1,72 @@
+import re
+
+# Compiles ordered tables of (pattern, replacement) rules, such as the firm suffix
+# tables in title_tools, into a few combined regexes.
+# A table is a list of stages: the rules of one stage run as a single alternation
+# in one pass, and stages run one after another. Only rules that cannot change
+# each other's matches may share a stage, so output is the same as running every
+# rule with its own re.sub in table order.
+
+def compile_stage(rules):
+    '''
+    Given list of (pattern, replacement) rules, returns compiled stage:
+    a combined regex with one named group per rule and a dictionary of
+    group name to replacement.
+    '''
+    if len(rules) == 1:
+        pattern, repl = rules[0]
+        return re.compile(pattern), repl
+    replacements = {f'r{i}': repl for i, (_, repl) in enumerate(rules)}
+    combined = re.compile('|'.join(f'(?P<r{i}>{pattern})' for i, (pattern, _) in enumerate(rules)))
+    return combined, lambda match: replacements[match.lastgroup]
+
+def compile_table(stages):
+    '''
+    Given list of stages (each a list of (pattern, replacement) rules),
+    returns compiled table for apply_table.
+    '''
+    return [compile_stage(rules) for rules in stages]
+
+def apply_table(table, text):
+    '''
+    Runs every stage of compiled table on text, in order.
+    '''
+    for pattern, repl in table:
+        text = pattern.sub(repl, text)
+    return text
+
+def compile_suffix_strip(suffixes):
+    '''
+    Given ordered list of suffix words that are each removed with re.sub(' WORD\\Z', '', name),
+    returns dictionary of word to the positions it has in the list.
+    '''
+    positions = {}
+    for i, suffix in enumerate(suffixes):
+        positions.setdefault(suffix, []).append(i)
+    return positions
+
+def strip_suffixes(positions, name):
+    '''
+    Removes suffix words from the end of name with the same result as running the
+    ' WORD\\Z' removals one after another in list order, but only looking at the
+    last word of name instead of trying every suffix.
+    '''
+    current = 0
+    while True:
+        cut = name.rfind(' ')
+        if cut < 0:
+            return name
+        # next removal in list order that matches the current last word
+        later = [i for i in positions.get(name[cut+1:], []) if i >= current]
+        if not later:
+            return name
+        name = name[:cut]
+        current = later[0]+1
+
+def apply_table_series(table, texts):
+    '''
+    Runs every stage of compiled table on pandas Series of text, in order.
+    '''
+    for pattern, repl in table:
+        texts = texts.str.replace(pattern, repl, regex=True)
+    return texts
@@ -1,12 +1,31 @@
+import os
+import pickle
+import hashlib
+import inspect
 import pandas as pd
+import numpy as np
 import re
+from functools import lru_cache
+from collections import OrderedDict
 from thefuzz import process
+from thefuzz import utils as fuzz_utils
+# thefuzz scores with rapidfuzz -- its cdist scores many names in one call
+import rapidfuzz
+from rapidfuzz import process as rf_process, fuzz as rf_fuzz
+import modules.ref_data as ref_data
+import modules.rule_tables as rule_tables
 
-# local laod
-# direc = './'
-# remote load
-direc = '/project/kh_mercury_1/conference_call/ciq/'
-name_dict = pd.read_csv(direc+'data_ref/known_name_probs.csv', index_col=0).squeeze('columns').to_dict()
+# number of names kept by each memoized cleaner (superclean, xml_clean_title, ...)
+cache_size = 2**18
+
+def __getattr__(name):
+    '''
+    name_dict is loaded from known_name_probs.csv on first use instead of at import -- 
+    see ref_data to point to a different file.
+    '''
+    if name == 'name_dict':
+        return ref_data.get('name_dict')
+    raise AttributeError(f'module {__name__} has no attribute {name}')
 
 
 def clean_ref_body(txt):
@@ -17,9 +36,114 @@ def clean_ref_body(txt):
     added appropriately
     '''
     txt = re.sub(r'-{2,}', '', txt)
-    txt = re.sub(r',{0,}\s*\[[0-9]{0,}\]((.|\n)*?)(?=([A-Z]|[a-z]))', ': ', txt)
-    return txt
+    # same as re.sub(r',{0,}\s*\[[0-9]{0,}\]((.|\n)*?)(?=([A-Z]|[a-z]))', ': ', txt),
+    # which backtracks quadratically on long bodies
+    return replace_speaker_markers(txt)
 
+speaker_marker = re.compile(r'\[[0-9]*\]')
+ascii_letter = re.compile('[A-Za-z]')
+
+def replace_speaker_markers(txt):
+    '''
+    Single pass scanner replacing every speaker marker ([<digits>]) with ': ',
+    together with the commas and whitespace before it and everything up to the next letter.
+    Gives the same output as the regex in clean_ref_body in linear time.
+    '''
+    out = []
+    pos = 0
+    while True:
+        marker = speaker_marker.search(txt, pos)
+        if not marker:
+            break
+        letter = ascii_letter.search(txt, marker.end())
+        # no letter left -- neither this marker nor any later one is replaced
+        if not letter:
+            break
+        # match starts at the commas, then whitespace, right before the marker
+        start = marker.start()
+        while start > pos and txt[start-1].isspace():
+            start -= 1
+        while start > pos and txt[start-1] == ',':
+            start -= 1
+        out.append(txt[pos:start])
+        out.append(': ')
+        pos = letter.start()
+    out.append(txt[pos:])
+    return ''.join(out)
+
+def clean_ref_body_stream(chunks):
+    '''
+    Streaming version of clean_ref_body: given iterable of text chunks of a body,
+    yields cleaned text pieces that join to clean_ref_body of the whole body.
+    Text is cleaned up to the last letter of what has been read so far,
+    since neither cleaning step can reach across a letter.
+    '''
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        cut = len(buffer)
+        while cut > 0 and not ('A' <= buffer[cut-1] <= 'Z' or 'a' <= buffer[cut-1] <= 'z'):
+            cut -= 1
+        if cut:
+            yield clean_ref_body(buffer[:cut])
+            buffer = buffer[cut:]
+    if buffer:
+        yield clean_ref_body(buffer)
+
+
+# firm suffix rules of standardize_suffix, in the order they are applied.
+# Rules of one stage run as a single regex, so a rule may only join a stage if it
+# cannot match text written or consumed by the other rules of that stage
+# (the spaced letter rules all consume trailing whitespace and stay on their own).
+suffix_rules = [
+    [
+        (r'\sSPÓLKA\sAKCYJNA', ' SA'),
+        (r'\sSOCIÉTÉ\sANONYME', ' SA'),
+        (r'\sSOCIEDAD\sANÓNIMA', ' SA'),
+        (r'\sANONIM\sSIRKETI', ' AS'),
+        (r'\sBERHAD', ' BHD'),
+        (r'\sAKTIENGESELLSCHAFT', ' AG'),
+        (r'\sAKTIEBOLAGET', ' AB'),
+        (r'\sAKTIEBOLAG', ' AB'),
+        (r'\sNAAMLOZE\sVENNOOTSCHAP', ' NV'),
+        (r'\sPUBLIC\sLIMITED\sCOMPANY', ' PLC'),
+        (r'\sOYJ', ' PLC'),
+        (r'\sPUBLIC\sCOMPANY\sLIMITED', ' PCL'),
+        (r'\sPUBLIC\sCO\sLTD', ' PCL'),
+        (r'\sJOINT\sSTOCK\sCOMPANY', ' JSC'),
+        (r'\sJOINT\sSTOCK\sCO', ' JSC'),
+        (r'\sREAL\sESTATE\sINVESTMENT\sTRUST', ' REIT'),
+        (r'\sINTERNATIONAL', ' INTL'),
+    ],
+    [(r'\sS\sA(?:\s+|$)', ' SA')],
+    [(r'\sA\sB(?:\s+|$)', ' AB')],
+    [(r'\sA\sG(?:\s+|$)', ' AG')],
+    [(r'\sA\sS(?:\s+|$)', ' AS')],
+    [(r'\sL\sP(?:\s+|$)', ' LP')],
+    [(r'\sL\.P(?:\s+|$)', ' LP')],
+    [(r'\sN\sV(?:\s+|$)', ' NV')],
+    [(r'\sC\sV(?:\s+|$)', ' CV')],
+    [(r'\sA\sS\sA(?:\s+|$)', ' ASA')],
+    [(r'\sS\sA\sB(?:\s+|$)', ' SAB')],
+    [(r'\sP\sL\sC(?:\s+|$)', ' PLC')],
+    [(r'\sP\sC\sL(?:\s+|$)', ' PCL')],
+    [(r'\sB\sH\sD(?:\s+|$)', ' BHD')],
+    [(r'\sO\sY\sJ(?:\s+|$)', ' OYJ')],
+    [
+        (r'\sINCORPORATED', ' INC'),
+        (r'\sCOMPANY', ' CO'),
+    ],
+    [
+        (r'\sCORPORATION', ' CORP'),
+        (r'\sLIMITED', ' LTD'),
+        (r'\sINTERNATIONAL', ' INTL'),
+        (r'\sGROUP', ' GP'),
+        (r'\sGROEP', ' GP'),
+        (r'\sCAPITAL', ' CAP'),
+        (r'\sREALTY', ' RLTY'),
+    ],
+]
+suffix_table = rule_tables.compile_table(suffix_rules)
 
 def standardize_suffix(title):
     '''
@@ -28,50 +152,41 @@ def standardize_suffix(title):
     title = title.upper()
 
     #Standardize common firm suffixes
-    title = re.sub(r'\sSPÓLKA\sAKCYJNA', ' SA', title)
-    title = re.sub(r'\sSOCIÉTÉ\sANONYME', ' SA', title)
-    title = re.sub(r'\sSOCIEDAD\sANÓNIMA', ' SA', title)
-    title = re.sub(r'\sANONIM\sSIRKETI', ' AS', title)
-    title = re.sub(r'\sBERHAD', ' BHD', title)
-    title = re.sub(r'\sAKTIENGESELLSCHAFT', ' AG', title)
-    title = re.sub(r'\sAKTIEBOLAGET', ' AB', title)
-    title = re.sub(r'\sAKTIEBOLAG', ' AB', title)
-    title = re.sub(r'\sNAAMLOZE\sVENNOOTSCHAP', ' NV', title)
-    title = re.sub(r'\sPUBLIC\sLIMITED\sCOMPANY', ' PLC', title)
-    title = re.sub(r'\sOYJ', ' PLC', title)
-    title = re.sub(r'\sPUBLIC\sCOMPANY\sLIMITED', ' PCL', title)
-    title = re.sub(r'\sPUBLIC\sCO\sLTD', ' PCL', title)
-    title = re.sub(r'\sJOINT\sSTOCK\sCOMPANY', ' JSC', title)
-    title = re.sub(r'\sJOINT\sSTOCK\sCO', ' JSC', title)
-    title = re.sub(r'\sREAL\sESTATE\sINVESTMENT\sTRUST', ' REIT', title)
-    title = re.sub(r'\sINTERNATIONAL', ' INTL', title)
-    title = re.sub(r'\sS\sA(?:\s+|$)', ' SA', title)
-    title = re.sub(r'\sA\sB(?:\s+|$)', ' AB', title)
-    title = re.sub(r'\sA\sG(?:\s+|$)', ' AG', title)
-    title = re.sub(r'\sA\sS(?:\s+|$)', ' AS', title)
-    title = re.sub(r'\sL\sP(?:\s+|$)', ' LP', title)
-    title = re.sub(r'\sL\.P(?:\s+|$)', ' LP', title)
-    title = re.sub(r'\sN\sV(?:\s+|$)', ' NV', title)
-    title = re.sub(r'\sC\sV(?:\s+|$)', ' CV', title)
-    title = re.sub(r'\sA\sS\sA(?:\s+|$)', ' ASA', title)
-    title = re.sub(r'\sS\sA\sB(?:\s+|$)', ' SAB', title)
-    title = re.sub(r'\sP\sL\sC(?:\s+|$)', ' PLC', title)
-    title = re.sub(r'\sP\sC\sL(?:\s+|$)', ' PCL', title)
-    title = re.sub(r'\sB\sH\sD(?:\s+|$)', ' BHD', title)
-    title = re.sub(r'\sO\sY\sJ(?:\s+|$)', ' OYJ', title)
-    title = re.sub(r'\sINCORPORATED', ' INC', title)
-    title = re.sub(r'\sCOMPANY', ' CO', title)
-    title = re.sub(r'\sCORPORATION', ' CORP', title)
-    title = re.sub(r'\sLIMITED', ' LTD', title)
-    title = re.sub(r'\sINTERNATIONAL', ' INTL', title)
-    title = re.sub(r'\sGROUP', ' GP', title)
-    title = re.sub(r'\sGROEP', ' GP', title)
-    title = re.sub(r'\sCAPITAL', ' CAP', title)
-    title = re.sub(r'\sREALTY', ' RLTY', title)
-
-    return title
+    return rule_tables.apply_table(suffix_table, title)
 
-    
+def standardize_suffix_series(titles):
+    '''
+    Series version of standardize_suffix.
+    '''
+    return rule_tables.apply_table_series(suffix_table, titles.str.upper())
+
+def clean_unique(titles, cleaner):
+    '''
+    Given pandas Series of titles and a Series cleaner, cleans every unique title
+    once and returns Series of cleaned titles with the index of titles.
+    Missing titles stay missing.
+    '''
+    # python dictionary instead of pandas lookups, which mix up titles starting with \x00
+    unique = list(dict.fromkeys(titles.dropna()))
+    cleaned = dict(zip(unique, cleaner(pd.Series(unique, dtype=object))))
+    return titles.map(cleaned.__getitem__, na_action='ignore')
+
+# leading and trailing whitespace
+outer_whitespace = re.compile(r'^\s*|\s*$')
+
+# rules of pdf_clean_title applied after standardizing suffixes, in order
+pdf_title_rules = [
+    # Remove everything after firm name written in (...)
+    (r' \([A-Z].*', ''),
+    # Remove everything before firm name if it is "EVENT TRANSCRIPT OF"  or "EVENT BRIEF OF"
+    ('^.+EVENT TRANSCRIPT OF ', ''),
+    ('^.+EVENT BRIEF OF ', ''),
+    # Remove everything after "CONFERENCE"
+    (' CONF.+$', ''),
+    # Remove everything after firm name if it is " - PRELIM..." or " _ FINAL..."
+    (' - +.*', ''),
+]
+pdf_title_table = rule_tables.compile_table([[rule] for rule in pdf_title_rules])
 
 #cleaner function for pdf-based title cleaning
 def pdf_clean_title(title):
@@ -87,22 +202,56 @@ def pdf_clean_title(title):
     # standardize firm suffix names
     name = standardize_suffix(name)
 
-    # Remove everything after firm name written in (...)
-    name = re.sub(r' \([A-Z].*', '', name)
-
-    # Remove everything before firm name if it is "EVENT TRANSCRIPT OF"  or "EVENT BRIEF OF"
-    name = re.sub('^.+EVENT TRANSCRIPT OF ', '', name)
-    name = re.sub('^.+EVENT BRIEF OF ', '', name)
-
-    # Remove everything after "CONFERENCE"
-    name = re.sub(' CONF.+$', '', name)
+    # Remove conference and event info, see pdf_title_rules
+    return rule_tables.apply_table(pdf_title_table, name)
 
-    # Remove everything after firm name if it is " - PRELIM..." or " _ FINAL..."
-    name = re.sub(' - +.*', '', name)
-
-    return name
+def pdf_clean_title_series(titles):
+    '''
+    Series version of pdf_clean_title: given pandas Series of PDF titles,
+    returns Series of cleaned titles (same output, one pass of each rule over all unique titles).
+    '''
+    def clean(names):
+        names = standardize_suffix_series(names.str.upper())
+        return rule_tables.apply_table_series(pdf_title_table, names)
+    return clean_unique(titles, clean)
+
+# rules of xml_clean_title applied before standardizing suffixes, in order
+xml_title_rules = [
+    (r'\*', ' '),
+    (r'Q[1-4]\s', ''),
+    (r'\sTHE\s|THE\s', ''),
+    (r'\.COM', ''),
+    (r'(FINAL\s|PRELIM|INTERIM\s|FULL\sYEAR|HALF\sYEAR|FY\s).*?[0-9]{4}\s', ''),
+    (r'(\sFINAL|\sPRELIM).*?RESULT', ''),
+    (r'[0-9]{4}(.*?)(?=[A-Z])', ''),
+    (r'\s-\s', ''),
+    (r'\sEARNINGS\s(.*)', ''),
+    (r'\sAT\s(.*)', ''),
+    (r'\sTO\s(.*)', ''),
+    (r'\sINVESTOR(.*)', ''),
+    (r'\sKEY PERFORMANCE(.*)', ''),
+    (r'\sCONFR(.*)', ''),
+    (r'\sCONFER(.*)', ''),
+    (r'\sANALYST(.*)', ''),
+    (r'\sMERGER\s(.*)', ''),
+    (r'\sVIDEO\s(.*)', ''),
+    (r'\sMANAG(.*)', ''),
+    (r'\sANNUAL\s(.*)', ''),
+    (r'\sFIRESIDE\s(.*)', ''),
+    (r'\sMIDTERM\s(.*)', ''),
+    (r'\sANNOUNCE(.*)', ''),
+    (r'\sDISCUSS(.*)', ''),
+    (r'\sCORPORATE\sS(.*)', ''),
+    (r'\sHOSTS\sS(.*)', ''),
+    (r'\s\'RESCHED(.*)', ''),
+    (r'\sAND\s[0-9]{4}\s(.*)', ''),
+    (r'\sAND\sYEAR-END{4}\s(.*)', ''),
+    (r'\sAUA\sAND\s(.*)', ''),
+]
+xml_title_table = rule_tables.compile_table([[rule] for rule in xml_title_rules])
 
 #cleaner function for xml-based title cleaning
+@lru_cache(maxsize=cache_size)
 def xml_clean_title(title):
     '''
     ***
@@ -112,112 +261,133 @@ def xml_clean_title(title):
     Returns cleaned title, which should be a firm name
     '''
     name = title.upper()
-    name = re.sub(r'\*', ' ', name)
-    name = re.sub(r'Q[1-4]\s', '', name)
-    name = re.sub(r'\sTHE\s|THE\s', '', name)
-    name = re.sub(r'\.COM', '', name)
-    name = re.sub(r'(FINAL\s|PRELIM|INTERIM\s|FULL\sYEAR|HALF\sYEAR|FY\s).*?[0-9]{4}\s', '', name)
-    name = re.sub(r'(\sFINAL|\sPRELIM).*?RESULT', '', name)
-    name = re.sub(r'[0-9]{4}(.*?)(?=[A-Z])', '', name)
-    name = re.sub(r'\s-\s', '', name)
-    name = re.sub(r'\sEARNINGS\s(.*)', '', name)
-    name = re.sub(r'\sAT\s(.*)', '', name)
-    name = re.sub(r'\sTO\s(.*)', '', name)
-    name = re.sub(r'\sINVESTOR(.*)', '', name)
-    name = re.sub(r'\sKEY PERFORMANCE(.*)', '', name)
-    name = re.sub(r'\sCONFR(.*)', '', name)
-    name = re.sub(r'\sCONFER(.*)', '', name)
-    name = re.sub(r'\sANALYST(.*)', '', name)
-    name = re.sub(r'\sMERGER\s(.*)', '', name)
-    name = re.sub(r'\sVIDEO\s(.*)', '', name)
-    name = re.sub(r'\sMANAG(.*)', '', name)
-    name = re.sub(r'\sANNUAL\s(.*)', '', name)
-    name = re.sub(r'\sFIRESIDE\s(.*)', '', name)
-    name = re.sub(r'\sMIDTERM\s(.*)', '', name)
-    name = re.sub(r'\sANNOUNCE(.*)', '', name)
-    name = re.sub(r'\sDISCUSS(.*)', '', name)
-    name = re.sub(r'\sCORPORATE\sS(.*)', '', name)
-    name = re.sub(r'\sHOSTS\sS(.*)', '', name)
-    name = re.sub(r'\s\'RESCHED(.*)', '', name)
-    name = re.sub(r'\sAND\s[0-9]{4}\s(.*)', '', name)
-    name = re.sub(r'\sAND\sYEAR-END{4}\s(.*)', '', name)
-    name = re.sub(r'\sAUA\sAND\s(.*)', '', name)
+    # Remove event info, see xml_title_rules
+    name = rule_tables.apply_table(xml_title_table, name)
 
     # standardize firm suffix names
     name = standardize_suffix(name)
 
     #Remove any extra remaining whitespace at the beginning or end of the string
-    name = re.sub(r'^\s*|\s*$', '', name)
+    name = outer_whitespace.sub('', name)
 
     return name
 
-#simple cleaning function that standardizes firm suffixes and removes punctuation
-def ciq_clean_title(title):
+def xml_clean_title_series(titles):
     '''
-    Runs a simple clean of company titles such as removing non-standard
-    characters, standardizing company suffixes, etc. 
-    Note: Somewhat specific to refinitiv xml titles, pdf titles, 
-    Compustat gvkey/title dataset, and WRDS Sec Historical title dataset
+    Series version of xml_clean_title: given pandas Series of event titles,
+    returns Series of cleaned titles (same output, one pass of each rule over all unique titles).
     '''
-    title = title.upper()
-
+    def clean(names):
+        names = rule_tables.apply_table_series(xml_title_table, names.str.upper())
+        names = standardize_suffix_series(names)
+        return names.str.replace(outer_whitespace, '', regex=True)
+    return clean_unique(titles, clean)
+
+# rules of ciq_clean_title applied before unescape_title, in order
+ciq_title_rules = [
     # Removing 'Q{1-4} Earnings' etc.
-    title = re.sub('Q[1-4] [0-9]{1,4}.*$', '', title)
+    ('Q[1-4] [0-9]{1,4}.*$', ''),
     # Removing 'H{1-2} Earnings' etc.
-    title = re.sub('H[1-2] [0-9]{1,4}.*$', '', title)
+    ('H[1-2] [0-9]{1,4}.*$', ''),
     # Removing {2020-2023} Earnings
-    title = re.sub('[0-9]{1,4} EARN.*$', '', title)
+    ('[0-9]{1,4} EARN.*$', ''),
     # Removing {2020-2023} Pre-Recorded Earnings
-    title = re.sub('[0-9]{1,4} PRE REC.*$', '', title)
+    ('[0-9]{1,4} PRE REC.*$', ''),
     # Remove 'Presents at' etc.
-    title = re.sub('PRESENTS AT.*$', '', title)
+    ('PRESENTS AT.*$', ''),
     # Remove '... - Shareholder/...' etc.
-    title = re.sub('- SHAREHOLDER/.*$', '', title)
+    ('- SHAREHOLDER/.*$', ''),
     # Remove '... - Analyst/...' etc.
-    title = re.sub('- ANALYST/.*$', '', title)
+    ('- ANALYST/.*$', ''),
     # Remove '... - M&A ...' etc.
-    title = re.sub('- M&A.*$', '', title)
+    ('- M&A.*$', ''),
     # Remove '... - Special ...' etc.
-    title = re.sub('- SPECIAL.*$', '', title)
-
+    ('- SPECIAL.*$', ''),
     # Remove non-standard things such as periods,commas,slashes,etc.
     # Add space after commas before removing them
-    title = re.sub(',(?=[A-Z1-9])', ' ', title)
-    title = re.sub(r'\(PUBL?.\)', ' ', title)
-    title = re.sub("[(),.'/]", '', title)
-    if r'\\' in repr(title):
-        title = re.sub('\\\\*', '', repr(title))
-        title = eval(title)
-    title = re.sub(r'\s\-\s', ' ', title)
-    title = re.sub(r'\-', ' ', title)
-    title = re.sub(r'\s&\s', ' AND ', title)
+    (',(?=[A-Z1-9])', ' '),
+    (r'\(PUBL?.\)', ' '),
+    ("[(),.'/]", ''),
+]
+ciq_title_table = rule_tables.compile_table([[rule] for rule in ciq_title_rules])
+
+# rules of ciq_clean_title applied after unescape_title, in order
+ciq_title_dash_rules = [
+    (r'\s\-\s', ' '),
+    (r'\-', ' '),
+    (r'\s&\s', ' AND '),
+]
+ciq_title_dash_table = rule_tables.compile_table([[rule] for rule in ciq_title_dash_rules])
+
+def unescape_title(title):
+    '''
+    If title contains a backslash, removes it and replaces every character repr would
+    escape (tab, newline, \\x00, ...) by its escape code without the backslash (e.g. tab -> t).
+    Same as the eval(repr(title)) round trip ciq_clean_title used to run with the
+    backslashes of repr removed, for titles without single quotes.
+    '''
+    if '\\' not in title:
+        return title
+    return ''.join(c if c.isprintable() and c != '\\' else repr(c)[1:-1].replace('\\', '') for c in title)
+
+#simple cleaning function that standardizes firm suffixes and removes punctuation
+@lru_cache(maxsize=cache_size)
+def ciq_clean_title(title):
+    '''
+    Runs a simple clean of company titles such as removing non-standard
+    characters, standardizing company suffixes, etc. 
+    Note: Somewhat specific to refinitiv xml titles, pdf titles, 
+    Compustat gvkey/title dataset, and WRDS Sec Historical title dataset
+    '''
+    title = title.upper()
+
+    # Remove event info and punctuation, see ciq_title_rules
+    title = rule_tables.apply_table(ciq_title_table, title)
+    # Remove backslashes and escape non-printable characters
+    title = unescape_title(title)
+    title = rule_tables.apply_table(ciq_title_dash_table, title)
 
     # standardize firm suffix names
     title = standardize_suffix(title)
 
     #Remove any extra remaining whitespace at the beginning or end of the string
-    title = re.sub(r'^\s*|\s*$', '', title)
+    title = outer_whitespace.sub('', title)
 
     return title.upper()
 
-
-#very strict cleaner to maximize chance of matching
-def superclean(name):
+def ciq_clean_title_series(titles):
     '''
-    name: string of a firm name \n
-    db: string determining if ciq clean title should be used instead of \
-    traditional refinitiv-based cleaner\n
-
-    Returns bare minimum string to represent the company. 
-    This is done by removing common suffixes (LLC, SPA, CO, SA, etc.), 
-    as well as some additional cleans encountered through testing
+    Series version of ciq_clean_title: given pandas Series of titles,
+    returns Series of cleaned titles (same output, one pass of each rule over all unique titles).
+    '''
+    def clean(names):
+        names = rule_tables.apply_table_series(ciq_title_table, names.str.upper())
+        names = names.map(unescape_title)
+        names = rule_tables.apply_table_series(ciq_title_dash_table, names)
+        names = standardize_suffix_series(names)
+        return names.str.replace(outer_whitespace, '', regex=True).str.upper()
+    return clean_unique(titles, clean)
+
+
+# firm suffixes removed from the end of names by superclean, in the order they are removed
+superclean_suffixes = [
+    'LLC', 'SPA', 'INC', 'CO', 'SA', 'AS', 'AB', 'PLC', 'PCL', 'CORP',
+    'LTD', 'OYJ', 'BHD', 'AG', 'ASA', 'SAB', 'LP', 'NV', 'JSC', 'REIT',
+    'LP', 'CV', 'INTL', 'GROUP', 'GP', 'CAPITAL', 'CAP', 'REALTY', 'RLTY', 'AND',
+]
+superclean_suffix_table = rule_tables.compile_suffix_strip(superclean_suffixes)
+
+@lru_cache(maxsize=cache_size)
+def cached_superclean(name):
+    '''
+    superclean without the name_dict check -- use superclean.
     '''
     name = name.upper()
     # standardize suffixes in firm names
     name = standardize_suffix(name)
 
     #use name discrepancy info to minimize problems
-    name = name_dict.get(name, name)
+    name = ref_data.get('name_dict').get(name, name)
 
     #Remove non-standard things such as periods,commas,slashes,etc.
     name = re.sub(r'[^\-a-zA-Z0-9_\s]', '', name)
@@ -226,36 +396,7 @@ def superclean(name):
     name = re.sub('^THE', '', name)
 
     # Remove common firm suffixes
-    name = re.sub(r' LLC\Z', '', name)
-    name = re.sub(r' SPA\Z', '', name)
-    name = re.sub(r' INC\Z', '', name)
-    name = re.sub(r' CO\Z', '', name)
-    name = re.sub(r' SA\Z', '', name)
-    name = re.sub(r' AS\Z', '', name)
-    name = re.sub(r' AB\Z', '', name)
-    name = re.sub(r' PLC\Z', '', name)
-    name = re.sub(r' PCL\Z', '', name)
-    name = re.sub(r' CORP\Z', '', name)
-    name = re.sub(r' LTD\Z', '', name)
-    name = re.sub(r' OYJ\Z', '', name)
-    name = re.sub(r' BHD\Z', '', name)
-    name = re.sub(r' AG\Z', '', name)
-    name = re.sub(r' ASA\Z', '', name)
-    name = re.sub(r' SAB\Z', '', name)
-    name = re.sub(r' LP\Z', '', name)
-    name = re.sub(r' NV\Z', '', name)
-    name = re.sub(r' JSC\Z', '', name)
-    name = re.sub(r' REIT\Z', '', name)
-    name = re.sub(r' LP\Z', '', name)
-    name = re.sub(r' CV\Z', '', name)
-    name = re.sub(r' INTL\Z', '', name)
-    name = re.sub(r' GROUP\Z', '', name)
-    name = re.sub(r' GP\Z', '', name)
-    name = re.sub(r' CAPITAL\Z', '', name)
-    name = re.sub(r' CAP\Z', '', name)
-    name = re.sub(r' REALTY\Z', '', name)
-    name = re.sub(r' RLTY\Z', '', name)
-    name = re.sub(r' AND\Z', '', name)
+    name = rule_tables.strip_suffixes(superclean_suffix_table, name)
 
     # Remove everything after firm name written in (...)
     name = re.sub(r' \([A-Z].*', '', name)
@@ -265,6 +406,58 @@ def superclean(name):
     
     return name
 
+# name_dict the superclean cache was filled with
+superclean_name_dict = None
+
+#very strict cleaner to maximize chance of matching
+def superclean(name):
+    '''
+    name: string of a firm name \n
+    db: string determining if ciq clean title should be used instead of \
+    traditional refinitiv-based cleaner\n
+
+    Returns bare minimum string to represent the company. 
+    This is done by removing common suffixes (LLC, SPA, CO, SA, etc.), 
+    as well as some additional cleans encountered through testing
+
+    Memoized: repeated names are a dictionary lookup. The cache is dropped
+    whenever name_dict is reloaded (e.g. after ref_data.set_path).
+    '''
+    global superclean_name_dict
+    name_dict = ref_data.get('name_dict')
+    if name_dict is not superclean_name_dict:
+        cached_superclean.cache_clear()
+        superclean_name_dict = name_dict
+    return cached_superclean(name)
+
+# memoized cleaners, by name
+memoized = {'superclean': cached_superclean, 'xml_clean_title': xml_clean_title, 'ciq_clean_title': ciq_clean_title}
+
+def cache_stats():
+    '''
+    Returns dataframe of hits, misses, size and hit rate of the cache of every memoized cleaner.
+    '''
+    stats = pd.DataFrame([cleaner.cache_info()._asdict() for cleaner in memoized.values()], index=list(memoized))
+    stats['hit_rate'] = stats.hits/(stats.hits+stats.misses).clip(lower=1)
+    return stats
+
+def clear_caches():
+    '''
+    Empties the cache of every memoized cleaner.
+    '''
+    for cleaner in memoized.values():
+        cleaner.cache_clear()
+
+# rules of clean_tickers, in order
+ticker_rules = [
+    (r'^\*.*?(?=[A-Z])', ''),
+    (r'\.[A-Z][^\.](.*)', ''),
+    (r'\.[A-Z]\Z', ''),
+    (r'^\d+$', ''),
+    (r'^[A-Z][0-9]{6}', ''),
+]
+ticker_table = rule_tables.compile_table([[rule] for rule in ticker_rules])
+
 #cleaner for tickers
 def clean_tickers(title):
     '''
@@ -275,19 +468,58 @@ def clean_tickers(title):
     more obvious
     '''
     nam = title.upper()
-    nam = re.sub(r'^\*.*?(?=[A-Z])', '', nam)
-    nam = re.sub(r'\.[A-Z][^\.](.*)', '', nam)
-    nam = re.sub(r'\.[A-Z]\Z', '', nam)
-    nam = re.sub(r'^\d+$', '', nam)
-    nam = re.sub(r'^[A-Z][0-9]{6}', '', nam)
+    nam = rule_tables.apply_table(ticker_table, nam)
 
     return nam
 
+def clean_tickers_series(titles):
+    '''
+    Series version of clean_tickers: given pandas Series of event titles,
+    returns Series of cleaned titles (same output, one pass of each rule over all unique titles).
+    '''
+    return clean_unique(titles, lambda names: rule_tables.apply_table_series(ticker_table, names.str.upper()))
+
+# columns add_clean_name_cols adds to master datasets
+clean_name_cols = ['cleaned', 'nospace', 'len']
+
+def add_clean_name_cols(master, name_col: str = 'firm_name'):
+    '''
+    Given master dataset, adds the columns basic_compare needs for every firm name
+    in name_col, so they are computed once instead of on every comparison:
+    cleaned: supercleaned firm name
+    nospace: cleaned without spaces
+    len: length of nospace
+    Rows with a missing firm name get missing values.
+    Returns master.
+    '''
+    names = master[name_col].dropna().unique()
+    cleaned = pd.Series([superclean(name) for name in names], index=names)
+    master['cleaned'] = master[name_col].map(cleaned).astype(object)
+    master['nospace'] = master.cleaned.str.replace(' ', '')
+    master['len'] = master.nospace.str.len()
+    return master
+
+# bump when the cleaning behind superclean changes in a way clean_rules_stamp cannot see
+clean_rules_version = 1
+
+def clean_rules_stamp():
+    '''
+    Returns stamp of the name cleaning rules and code behind superclean and add_clean_name_cols, 
+    so data built with them (cleaned master columns, cached scores) is rebuilt when they change.
+    '''
+    # only data that is the same in every process -- reprs of code objects hold memory addresses
+    parts = [clean_rules_version, suffix_rules, superclean_suffixes]
+    for func in [standardize_suffix, cached_superclean.__wrapped__, add_clean_name_cols]:
+        parts.append(inspect.getsource(func))
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
 #basic compare function to make fuzzy matching more efficient
-def basic_compare(str1, strs):
+def basic_compare(str1, strs, name_col: str = 'firm_name'):
     '''
     str1: string of firm name to be matched
-    strs: **unique** list of possible string matches
+    strs: **unique** list of possible string matches, or dataframe of them
+    with the columns of add_clean_name_cols (e.g. subspace of an enriched master)
+    name_col: column of firm names if strs is a dataframe
     returns a supercleaned version of str1 as well as a dataframe of 
     given strs with their cleaned counterparts
 
@@ -297,32 +529,315 @@ def basic_compare(str1, strs):
     str1 = superclean(str1)
     str1_nospace = str1.replace(' ', '')
     str1_len = len(str1_nospace)
-    strs = pd.DataFrame(strs, columns=['names'])
-    strs['cleaned'] = strs.names.apply(superclean)
-    strs['nospace'] = strs.cleaned.str.replace(' ', '')
-    strs['lens'] = strs.nospace.apply(len)
-    strs = strs[((str1_len -2) <= strs.lens) & (strs.lens <= (str1_len+2))]
+    if isinstance(strs, pd.DataFrame):
+        # precomputed columns, one row per firm name
+        strs = strs[[name_col]+clean_name_cols].dropna(subset=[name_col]).drop_duplicates(subset=name_col)
+        strs = strs.rename(columns={name_col: 'names'})
+    else:
+        strs = pd.DataFrame(strs, columns=['names'])
+        strs['cleaned'] = strs.names.apply(superclean)
+        strs['nospace'] = strs.cleaned.str.replace(' ', '')
+        strs['len'] = strs.nospace.apply(len)
+    strs = strs[((str1_len -2) <= strs['len']) & (strs['len'] <= (str1_len+2))]
     strs.set_index('cleaned', inplace=True)
     return [str1, strs[['names']]]
 
+def name_grams(name, n: int = 3):
+    '''
+    Returns set of character n-grams of cleaned firm name, padded with a space at both ends.
+    '''
+    name = f' {name} '
+    return {name[i:i+n] for i in range(len(name)-n+1)}
+
+def build_name_index(cleaned_names, n: int = 3):
+    '''
+    Given cleaned firm names (e.g. cleaned column of an enriched master),
+    returns character n-gram inverted index of the unique names:
+    names: array of unique cleaned names
+    ids: dictionary of cleaned name to its position in names
+    postings: dictionary of n-gram to array of positions of names containing it
+    gram_ids: dictionary of n-gram to its position in postings
+    name_grams, offsets: gram_ids of the n-grams of every name, one name after another --
+    those of name i are name_grams[offsets[i]:offsets[i+1]]
+    '''
+    names = pd.Series(cleaned_names).dropna().unique()
+    postings, grams_of_names = {}, []
+    for name_id, name in enumerate(names):
+        grams = name_grams(name, n)
+        for gram in grams:
+            postings.setdefault(gram, []).append(name_id)
+        grams_of_names.append(grams)
+    gram_ids = {gram: i for i, gram in enumerate(postings)}
+    postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+    lengths = [len(grams) for grams in grams_of_names]
+    return {'n': n, 'names': names, 'ids': {name: i for i, name in enumerate(names)}, 'postings': postings,
+            'gram_ids': gram_ids,
+            'name_grams': np.array([gram_ids[gram] for grams in grams_of_names for gram in grams], dtype=np.int32),
+            'offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)}
+
+def name_index_stamp():
+    '''
+    Returns stamp of the cleaning rules and the layout of build_name_index, 
+    so a saved name index is rebuilt when either changes.
+    '''
+    return hashlib.sha1(repr([clean_rules_stamp(), inspect.getsource(build_name_index)]).encode()).hexdigest()
+
+def name_ids(index, cleaned_names):
+    '''
+    Given name index from build_name_index and cleaned firm names (e.g. cleaned column 
+    of a date subspace), returns array of the index ids of the names, for name_candidates.
+    '''
+    ids = index['ids']
+    return np.array([ids[name] for name in pd.unique(pd.Series(cleaned_names).dropna()) if name in ids], dtype=np.int32)
+
+def name_candidates(index, name, top_k: int = 50, within = None):
+    '''
+    Given name index from build_name_index and cleaned firm name, returns set of
+    the top_k indexed names sharing the most n-grams with name.
+    within: optional array of (unique) index ids to choose from (see name_ids)
+    With within, only the n-grams of those names are counted, so cost grows with 
+    the size of within (e.g. a date subspace) rather than the number of indexed names. 
+    Otherwise the posting lists of the n-grams of name are counted.
+    '''
+    if within is None:
+        postings = index['postings']
+        hits = [postings[gram] for gram in name_grams(name, index['n']) if gram in postings]
+        if not hits:
+            return set()
+        ids, counts = np.unique(np.concatenate(hits), return_counts=True)
+    else:
+        gram_ids = index['gram_ids']
+        in_query = np.zeros(len(gram_ids), dtype=bool)
+        in_query[[gram_ids[gram] for gram in name_grams(name, index['n']) if gram in gram_ids]] = True
+        within = np.sort(within)
+        # n-grams of every name of within, one name after another
+        starts, stops = index['offsets'][within], index['offsets'][within+1]
+        lengths = stops-starts
+        firsts = np.cumsum(lengths)-lengths
+        shared = np.concatenate([[0], np.cumsum(in_query[index['name_grams'][np.arange(lengths.sum())+np.repeat(starts-firsts, lengths)]])])
+        counts = shared[firsts+lengths]-shared[firsts]
+        ids, counts = within[counts > 0], counts[counts > 0]
+        if not len(ids):
+            return set()
+    if len(ids) > top_k:
+        ids = ids[np.argpartition(-counts, top_k-1)[:top_k]]
+    return set(index['names'][ids])
+
+# most (name, candidate) scores kept by the score cache -- the least recently used ones are dropped first
+score_cache_size = 2**21
+
+# on-disk cache of fuzzy scores of (cleaned name, cleaned candidate) pairs, filled by compare_names
+# once load_score_cache was called -- reruns only score new pairs.
+# Saved as an append-only log: a stamp, then batches of new scores.
+score_cache = {'path': None, 'stamp': None, 'scores': OrderedDict(), 'new': [], 'logged': None, 'hits': 0, 'misses': 0}
+
+def score_cache_stamp():
+    '''
+    Returns stamp of everything cached scores depend on: known_name_probs.csv (path and mtime),
+    the cleaning rules of superclean (see clean_rules_stamp) and the scorer version.
+    A cache saved with another stamp is dropped by load_score_cache.
+    '''
+    path = ref_data.paths['known_name_probs']
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    parts = [os.path.abspath(path), mtime, clean_rules_stamp(), 'rapidfuzz', rapidfuzz.__version__]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def score_cache_path():
+    '''
+    Returns default path of the score cache: next to known_name_probs.csv (or in ref_data.cache_dir).
+    '''
+    folder = ref_data.cache_dir or os.path.dirname(ref_data.paths['known_name_probs']) or '.'
+    return f'{folder}/.name_scores.pkl'
+
+def remember_score(scores, pair, score):
+    '''
+    Adds score of pair to the LRU dictionary scores, dropping the oldest ones above score_cache_size.
+    '''
+    scores[pair] = score
+    scores.move_to_end(pair)
+    while len(scores) > score_cache_size:
+        scores.popitem(last=False)
+
+def load_score_cache(path = None):
+    '''
+    Turns on the score cache of compare_names, loading the scores saved at path
+    (default score_cache_path()) if they were saved with the current score_cache_stamp.
+    '''
+    path = path or score_cache_path()
+    stamp = score_cache_stamp()
+    if score_cache['path'] == path and score_cache['stamp'] == stamp:
+        return
+    scores, logged = OrderedDict(), None
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                if pickle.load(f) == {'stamp': stamp}:
+                    size = os.fstat(f.fileno()).st_size
+                    count = 0
+                    while f.tell() < size:
+                        batch = pickle.load(f)
+                        count += len(batch)
+                        for pair, score in batch:
+                            remember_score(scores, pair, score)
+                    logged = count
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # unreadable (e.g. cut off) log keeps what was read and is rewritten on save
+            pass
+    score_cache.update({'path': path, 'stamp': stamp, 'scores': scores, 'new': [], 'logged': logged})
+
+def save_score_cache():
+    '''
+    Appends the scores computed since the last save to the score cache file.
+    The file is rewritten with only the kept scores instead if it has another stamp,
+    could not be read, or would hold more than twice score_cache_size scores.
+    '''
+    if score_cache['path'] is None:
+        return
+    path, new, logged = score_cache['path'], score_cache['new'], score_cache['logged']
+    try:
+        if logged is None or logged+len(new) > 2*score_cache_size:
+            tmp = path+'.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump({'stamp': score_cache['stamp']}, f)
+                pickle.dump(list(score_cache['scores'].items()), f)
+            os.replace(tmp, path)
+            score_cache['logged'] = len(score_cache['scores'])
+        elif new:
+            with open(path, 'ab') as f:
+                pickle.dump(new, f)
+            score_cache['logged'] = logged+len(new)
+        score_cache['new'] = []
+    except OSError:
+        # cache folder not writable -- keep going without saving
+        pass
+
+def score_cache_stats():
+    '''
+    Returns dictionary of hits, misses, hit rate and size of the score cache.
+    '''
+    hits, misses = score_cache['hits'], score_cache['misses']
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits/max(hits+misses, 1), 'size': len(score_cache['scores'])}
+
+def pair_scores(str1, choices):
+    '''
+    Given cleaned firm name and list of cleaned candidate names, returns list of
+    their raw fuzzy scores (the ones process.extractOne ranks by), looking up known
+    pairs in the score cache and only scoring new ones.
+    '''
+    scores = score_cache['scores']
+    unique = dict.fromkeys(choices)
+    missing = []
+    for choice in unique:
+        if (str1, choice) in scores:
+            scores.move_to_end((str1, choice))
+        else:
+            missing.append(choice)
+    score_cache['hits'] += len(unique)-len(missing)
+    score_cache['misses'] += len(missing)
+    if missing:
+        # same processing process.extractOne applies to the query and to every choice
+        query = fuzz_utils.full_process(fuzz_utils.full_process(str1), force_ascii=True)
+        processed = [fuzz_utils.full_process(choice, force_ascii=True) for choice in missing]
+        new_scores = rf_process.cdist([query], processed, scorer=rf_fuzz.WRatio, dtype=np.float64)[0]
+        for choice, score in zip(missing, new_scores.tolist()):
+            remember_score(scores, (str1, choice), score)
+            score_cache['new'].append(((str1, choice), score))
+    return [scores[(str1, choice)] for choice in choices]
+
 #fuzzy matching function
-def compare_names(str1, strs):
+def compare_names(str1, strs, name_col: str = 'firm_name', index = None, top_k: int = 50):
     '''
     str1: string of firm name to match
-    strs: **unique** list of possible string matches
+    strs: **unique** list of possible string matches, or dataframe of them
+    with the columns of add_clean_name_cols (see basic_compare)
+    index: optional name index from build_name_index -- if given, only the top_k
+    names of strs sharing the most character n-grams with str1 are fuzzy scored.
+    With a dataframe of strs, this blocking runs first, so only those names are compared further.
+    Scores come from the score cache once load_score_cache was called.
     Returns True if fuzzy match had a >= 95% match, as well as
     the best match from strs
     '''
-    basic_res = basic_compare(str1, strs)
+    if index is not None and isinstance(strs, pd.DataFrame):
+        # block on precomputed columns: top_k names within basic_compare's length rule
+        cleaned = superclean(str1)
+        str1_len = len(cleaned.replace(' ', ''))
+        near = strs[strs[name_col].notna() & ((str1_len-2) <= strs['len']) & (strs['len'] <= (str1_len+2))]
+        strs = near[near.cleaned.isin(name_candidates(index, cleaned, top_k, within=name_ids(index, near.cleaned)))]
+    basic_res = basic_compare(str1, strs, name_col)
     str1 = basic_res[0]  
     strs_df = basic_res[1]
+    if index is not None and not isinstance(strs, pd.DataFrame):
+        strs_df = strs_df[strs_df.index.isin(name_candidates(index, str1, top_k, within=name_ids(index, strs_df.index)))]
     if strs_df.shape[0] < 1:
         return [False]
-    best = process.extractOne(str1, list(strs_df.index))
+    if score_cache['path'] is None:
+        best = process.extractOne(str1, list(strs_df.index))
+    else:
+        # first choice with the highest raw score, as in process.extractOne
+        choices = list(strs_df.index)
+        scores = pair_scores(str1, choices)
+        best_i = max(range(len(choices)), key=scores.__getitem__)
+        best = (choices[best_i], int(round(scores[best_i])))
     rating = True if best[1] >= 95 else False
     final = strs_df.loc[best[0]]
     res = final.values[0]
     if final.shape[0] > 1:
         res = final['names'].iloc[0]
         
-    return [rating, res]
\ No newline at end of file
+    return [rating, res]
+
+def batch_compare_names(queries, strs, name_col: str = 'firm_name', score_cutoff: int = 95, chunk_size: int = 2000):
+    '''
+    Batch version of compare_names for many firm names at once.
+    queries: list of firm names to match
+    strs: **unique** list of possible string matches, or dataframe of them
+    with the columns of add_clean_name_cols (see basic_compare)
+    score_cutoff: lowest score that counts as a match
+    chunk_size: number of queries scored in one call (bounds memory of the score matrix)
+
+    Every chunk of queries is scored against every candidate in one vectorized call
+    (same cleaning, scorer, +/-2 length rule and tie breaking as compare_names),
+    and candidates below score_cutoff are dropped early.
+    Returns dataframe with one row per query: query, rating (True if a match
+    scored >= score_cutoff), match (best name from strs, missing if no match) and score.
+    '''
+    queries = list(queries)
+    if isinstance(strs, pd.DataFrame):
+        cands = strs[[name_col]+clean_name_cols].dropna(subset=[name_col]).drop_duplicates(subset=name_col)
+        cands = cands.rename(columns={name_col: 'names'})
+    else:
+        cands = add_clean_name_cols(pd.DataFrame({'names': list(strs)}), 'names')
+    names = cands.names.to_numpy()
+    lens = cands['len'].to_numpy(dtype=float)
+
+    # same processing process.extractOne applies to the query and to every choice
+    q_cleaned = [superclean(query) for query in queries]
+    q_lens = np.array([len(query.replace(' ', '')) for query in q_cleaned], dtype=float)
+    q_proc = [fuzz_utils.full_process(fuzz_utils.full_process(query), force_ascii=True) for query in q_cleaned]
+    c_proc = [fuzz_utils.full_process(cleaned, force_ascii=True) for cleaned in cands.cleaned]
+
+    best_ids = np.zeros(len(queries), dtype=int)
+    best_scores = np.zeros(len(queries))
+    if len(c_proc):
+        for start in range(0, len(queries), chunk_size):
+            stop = start+chunk_size
+            # compare_names rounds scores, so anything from cutoff-0.5 can still round up to the cutoff
+            scores = rf_process.cdist(q_proc[start:stop], c_proc, scorer=rf_fuzz.WRatio, dtype=np.float64,
+                                      score_cutoff=score_cutoff-0.5, workers=-1)
+            # only candidates within 2 characters of the query, as in basic_compare
+            scores[np.abs(lens[None, :] - q_lens[start:stop, None]) > 2] = 0
+            best_ids[start:stop] = scores.argmax(axis=1)
+            best_scores[start:stop] = np.rint(scores[np.arange(scores.shape[0]), best_ids[start:stop]])
+
+    rating = best_scores >= score_cutoff
+    return pd.DataFrame({'query': queries,
+                         'rating': rating,
+                         'match': np.where(rating, names[best_ids] if len(names) else None, None),
+                         'score': best_scores.astype(int)})
+
+# ciq master with the columns of add_clean_name_cols, rebuilt when the master, known_name_probs or the cleaning rules change
+ref_data.register('ciq_master_clean', 'ciq_master', lambda path: add_clean_name_cols(ref_data.load_ciq_master(path)),
+                  depends_on=['known_name_probs'], stamp=clean_rules_stamp)
+# trigram index of the cleaned firm names of the ciq master, for compare_names
+ref_data.register('ciq_name_index', 'ciq_master', lambda path: build_name_index(ref_data.get('ciq_master_clean').cleaned),
+                  depends_on=['known_name_probs'], stamp=name_index_stamp)